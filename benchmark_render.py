@@ -0,0 +1,159 @@
+# Benchmark suite for the flute renderers.
+# Times each renderer on a fixed set of melodies, compares the measurements with the
+# render cost model, reports the speedup over the per-note renderer and the synthesis calls
+# made by the grouped renderer, and prints refitted coefficients for render_cost.py.
+# With --pipeline it also compares render_pipeline against serial synthesis + encoding with the
+# grouped renderer (the fastest whole-file path) and with the vectorised one.
+#
+#   python benchmark_render.py
+#   python benchmark_render.py --repeat 5 --renderer vectorised --json
+#   python benchmark_render.py --pipeline flac
+
+import argparse
+import json
+import random
+import time
+
+from flute_synth import (default_sample_rate, parse_notes_input, renderers, render_sequence_grouped,
+                         render_sequence_vectorised)
+from render_cost import calibrate, cost_coefficients, estimate_render_cost
+from render_pipeline import audio_mime_types, encode_audio, stream_audio
+
+benchmark_melodies = [
+    "DS>DP,GRSR,G-GR,GPD_",
+    "SRGMPDN>S>",
+    "S___R___G___M___P___",
+    "S<R<G<M<P<D<N<SRGMPDNS>R>G>M>P>D>N>",
+]
+benchmark_bpms = [30, 60, 120, 200]
+# Very slow tempos: few, long unique events, where the grouped renderer's 2-D batches dominate
+slow_melodies = ["S", "SRGMPDN"]
+slow_bpms = [5]
+
+def random_melody(rng, length):
+    notes = ['S', 'R', 'G', 'M', 'P', 'D', 'N', '-']
+    octaves = ['', '>', '<']
+    melody = ''
+    for _ in range(length):
+        note = rng.choice(notes)
+        octave = rng.choice(octaves) if note != '-' else ''
+        melody += f"{note}{octave}{'_' * rng.randint(0, 2)}"
+    return melody
+
+def benchmark_cases(seed=0):
+    rng = random.Random(seed)
+    melodies = benchmark_melodies + [random_melody(rng, length) for length in (12, 48, 200)]
+    return ([(parse_notes_input(melody), bpm) for melody in melodies for bpm in benchmark_bpms]
+            + [(parse_notes_input(melody), bpm) for melody in slow_melodies for bpm in slow_bpms])
+
+def run_benchmark(cases, renderer, repeat=3, sample_rate=default_sample_rate):
+    results = []
+    for parsed_sequence, bpm in cases:
+        estimate = estimate_render_cost(parsed_sequence, bpm, sample_rate, renderer)
+        timings = []
+        stats = {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if renderer == 'grouped':
+                renderers[renderer](parsed_sequence, bpm, sample_rate=sample_rate, stats=stats)
+            else:
+                renderers[renderer](parsed_sequence, bpm, sample_rate=sample_rate)
+            timings.append(time.perf_counter() - start)
+        results.append({
+            'renderer': renderer,
+            'notes': estimate['notes'],
+            'bpm': bpm,
+            'samples': estimate['samples'],
+            # Calls into the synthesis kernel: one per note unless the renderer batches them
+            'synthesis_calls': stats.get('synthesis_calls', estimate['notes']),
+            'predicted_cpu_s': estimate['cpu_seconds'],
+            'measured_cpu_s': min(timings),
+        })
+    return results
+
+def run_pipeline_benchmark(cases, audio_format, repeat=3, sample_rate=default_sample_rate):
+    results = []
+    for parsed_sequence, bpm in cases:
+        serial, synthesis, vectorised_serial, pipelined, first_chunk = [], [], [], [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            audio_data = render_sequence_grouped(parsed_sequence, bpm, sample_rate)
+            synthesised = time.perf_counter()
+            encode_audio(audio_data, sample_rate, audio_format)
+            serial.append(time.perf_counter() - start)
+            synthesis.append(synthesised - start)
+
+            start = time.perf_counter()
+            encode_audio(render_sequence_vectorised(parsed_sequence, bpm, sample_rate), sample_rate, audio_format)
+            vectorised_serial.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            first = None
+            for _chunk in stream_audio(parsed_sequence, bpm, sample_rate, audio_format=audio_format):
+                first = first or time.perf_counter() - start
+            pipelined.append(time.perf_counter() - start)
+            first_chunk.append(first)
+        results.append({
+            'notes': len(parsed_sequence),
+            'bpm': bpm,
+            'grouped_synthesis_s': min(synthesis),
+            'grouped_serial_s': min(serial),
+            'vectorised_serial_s': min(vectorised_serial),
+            'pipelined_s': min(pipelined),
+            'first_chunk_s': min(first_chunk),
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the flute renderers and refit the cost model.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions per case (best is kept).")
+    parser.add_argument("--sample-rate", type=int, default=default_sample_rate)
+    parser.add_argument("--renderer", choices=sorted(renderers), action="append",
+                        help="Renderer to benchmark (repeatable, default: all).")
+    parser.add_argument("--pipeline", choices=sorted(audio_mime_types),
+                        help="Also time serial vs pipelined synthesis + encoding to this format.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    cases = benchmark_cases()
+    selected = args.renderer or sorted(renderers)
+    results = {name: run_benchmark(cases, name, args.repeat, args.sample_rate) for name in selected}
+    fitted = {name: calibrate(cases, args.sample_rate, name) for name in selected}
+    pipeline = run_pipeline_benchmark(cases, args.pipeline, args.repeat, args.sample_rate) if args.pipeline else []
+
+    if args.json:
+        print(json.dumps({'results': results, 'current': cost_coefficients, 'fitted': fitted,
+                          'pipeline': pipeline}, indent=2))
+        return
+
+    for name in selected:
+        print(f"\n[{name}]")
+        print(f"{'notes':>6} {'bpm':>4} {'samples':>10} {'calls':>6} {'predicted s':>12} {'measured s':>11}")
+        for row in results[name]:
+            print(f"{row['notes']:>6} {row['bpm']:>4} {row['samples']:>10} {row['synthesis_calls']:>6} "
+                  f"{row['predicted_cpu_s']:>12.4f} {row['measured_cpu_s']:>11.4f}")
+
+    if 'per_note' in results:
+        baseline = sum(row['measured_cpu_s'] for row in results['per_note'])
+        for name in selected:
+            if name != 'per_note':
+                total = sum(row['measured_cpu_s'] for row in results[name])
+                print(f"\nSpeedup of {name} over per_note: {baseline / total:.2f}x")
+
+    if pipeline:
+        print(f"\n[pipeline, {args.pipeline}]")
+        print(f"{'notes':>6} {'bpm':>4} {'grouped synth s':>16} {'grouped serial s':>17} "
+              f"{'vectorised serial s':>20} {'pipelined s':>12} {'first chunk s':>14}")
+        for row in pipeline:
+            print(f"{row['notes']:>6} {row['bpm']:>4} {row['grouped_synthesis_s']:>16.4f} "
+                  f"{row['grouped_serial_s']:>17.4f} {row['vectorised_serial_s']:>20.4f} "
+                  f"{row['pipelined_s']:>12.4f} {row['first_chunk_s']:>14.4f}")
+        grouped_total = sum(row['grouped_serial_s'] for row in pipeline)
+        pipelined_total = sum(row['pipelined_s'] for row in pipeline)
+        print(f"\nSpeedup of the pipeline over grouped serial: {grouped_total / pipelined_total:.2f}x")
+
+    print("\nFitted cost_coefficients:")
+    print(json.dumps(fitted, indent=4))
+
+if __name__ == "__main__":
+    main()
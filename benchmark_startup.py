@@ -0,0 +1,123 @@
+# Startup benchmark for the Streamlit apps.
+# Starts a fresh server per app and measures the time to first interactive (process start
+# until the first session's page has finished rendering) and a warm second page load, with
+# lazy and with eager imports (METRONOME_EAGER_IMPORTS), plus the heaviest imports of each app.
+#
+#   python benchmark_startup.py
+#   python benchmark_startup.py metronomev4.py --repeat 3 --json
+
+import argparse
+import ast
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from load_test import WebsocketSession, default_scripts, project_dir, scratch_melody_db, start_server, stream_url
+
+import_profile_top = 8
+startup_modes = {'lazy': "0", 'eager': "1"}
+
+def _env(mode):
+    env = dict(os.environ, METRONOME_EAGER_IMPORTS=startup_modes[mode])
+    env.setdefault("MELODY_DB_PATH", scratch_melody_db)
+    return env
+
+def entry_imports(script):
+    with open(os.path.join(project_dir, script), encoding="utf-8") as source:
+        tree = ast.parse(source.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def import_profile(script, mode='lazy'):
+    # Cumulative import time of each of the script's own imports, from python -X importtime;
+    # a module already pulled in by an earlier import is charged to that one
+    modules = entry_imports(script)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "; ".join(f"import {m}" for m in modules)],
+                            cwd=project_dir, env=_env(mode), capture_output=True, text=True)
+    seconds = {}
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2]
+        if not name.startswith("  ") and name.strip() in modules:
+            seconds[name.strip()] = int(fields[1]) / 1e6
+    return sorted(seconds.items(), key=lambda item: -item[1]), sum(seconds.values())
+
+async def _page_load(ws_url, timeout):
+    import websockets
+
+    async with websockets.connect(ws_url, subprotocols=["streamlit"], max_size=None, open_timeout=timeout) as ws:
+        elapsed, _, errors = await WebsocketSession(ws, timeout).rerun()
+    return elapsed, errors
+
+def measure_startup(script, mode='lazy', timeout=120):
+    spawned = time.perf_counter()
+    server, url = start_server(script, timeout, _env(mode))
+    try:
+        server_ready = time.perf_counter() - spawned
+        first_page, errors = asyncio.run(_page_load(stream_url(url), timeout))
+        first_interactive = time.perf_counter() - spawned
+        warm_page, warm_errors = asyncio.run(_page_load(stream_url(url), timeout))
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'server_ready_s': server_ready,
+        'first_page_s': first_page,
+        'time_to_first_interactive_s': first_interactive,
+        'warm_page_s': warm_page,
+        'errors': errors + warm_errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time of the Streamlit apps.")
+    parser.add_argument("scripts", nargs="*", default=default_scripts, help="App scripts to measure.")
+    parser.add_argument("--repeat", type=int, default=1, help="Fresh servers per app and mode (median is kept).")
+    parser.add_argument("--mode", choices=sorted(startup_modes), action="append",
+                        help="Import mode to measure (repeatable, default: both).")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    modes = args.mode or list(startup_modes)
+    results = {}
+    for script in args.scripts:
+        results[script] = {}
+        for mode in modes:
+            runs = [measure_startup(script, mode, args.timeout) for _ in range(args.repeat)]
+            row = {key: statistics.median(run[key] for run in runs) for key in runs[0] if key != 'errors'}
+            row['errors'] = sum(run['errors'] for run in runs)
+            imports, import_total = import_profile(script, mode)
+            row['import_s'] = import_total
+            row['heaviest_imports'] = imports[:import_profile_top]
+            results[script][mode] = row
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'app':>26} {'mode':>6} {'imports s':>10} {'server s':>9} {'first page s':>13} "
+          f"{'TTFI s':>7} {'warm page s':>12} {'errors':>6}")
+    for script, rows in results.items():
+        for mode, row in rows.items():
+            print(f"{script:>26} {mode:>6} {row['import_s']:>10.3f} {row['server_ready_s']:>9.3f} "
+                  f"{row['first_page_s']:>13.3f} {row['time_to_first_interactive_s']:>7.3f} "
+                  f"{row['warm_page_s']:>12.3f} {row['errors']:>6}")
+    for script, rows in results.items():
+        for mode, row in rows.items():
+            print(f"\nHeaviest imports of {script} ({mode}):")
+            for module, seconds in row['heaviest_imports']:
+                print(f"  {seconds:8.3f}s  {module}")
+
+if __name__ == "__main__":
+    main()
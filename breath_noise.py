@@ -0,0 +1,57 @@
+# Deterministic breath noise for the flute voice.
+# Noise comes from a counter-based Philox generator keyed by the melody hash, so the value at
+# any absolute sample index can be regenerated on its own: renders are byte-reproducible and
+# any chunk or note can be synthesised independently (and in parallel) with identical output.
+
+import functools
+
+import numpy as np
+
+noise_method = 'philox'   # or 'bank': faster lookups into a precomputed noise table
+noise_bank_size = 1 << 18
+default_noise_key = 0
+
+def noise_key(content_hash):
+    # Philox takes a 128-bit key; the leading half of a sha256 hex digest fills it
+    return int(content_hash[:32], 16)
+
+def philox_noise(key, start_sample, n):
+    # Each 64-bit Philox word yields two normals by Box-Muller (cos for the even sample, sin for
+    # the odd one), and Philox emits four words per counter value. Starting the counter at the
+    # block holding start_sample ties every sample to its absolute index, however the stream is cut.
+    first_word = start_sample // 2
+    last_word = (start_sample + n + 1) // 2
+    first_block = first_word // 4
+    skip = first_word - 4 * first_block
+    raw = np.random.Philox(key=key, counter=first_block).random_raw(skip + last_word - first_word)[skip:]
+
+    radius = ((raw >> np.uint64(32)).astype(np.float64) + 0.5) / 2 ** 32
+    np.log(radius, out=radius)
+    radius *= -2
+    np.sqrt(radius, out=radius)
+    angle = (raw & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    angle *= 2 * np.pi / 2 ** 32
+
+    pairs = np.empty((len(raw), 2))
+    np.cos(angle, out=pairs[:, 0])
+    np.sin(angle, out=pairs[:, 1])
+    pairs *= radius[:, None]
+    offset = start_sample - 2 * first_word
+    return pairs.ravel()[offset:offset + n]
+
+@functools.lru_cache(maxsize=1)
+def _noise_bank():
+    return philox_noise(default_noise_key, 0, noise_bank_size)
+
+def bank_noise(key, start_sample, n):
+    # Same indexing contract as philox_noise, read from a shared table at a per-melody offset
+    bank = _noise_bank()
+    first = (int(np.random.Philox(key=key).random_raw()) + start_sample) % noise_bank_size
+    if first + n <= noise_bank_size:
+        return bank[first:first + n].copy()
+    return np.take(bank, np.arange(first, first + n), mode='wrap')
+
+def breath_noise(key, start_sample, n):
+    if noise_method == 'bank':
+        return bank_noise(key, start_sample, n)
+    return philox_noise(key, start_sample, n)
@@ -0,0 +1,532 @@
+# Flute voice synthesis shared by the Streamlit apps and the benchmarks
+
+import collections
+import functools
+import hashlib
+import io
+import threading
+
+import numpy as np
+
+from breath_noise import breath_noise, noise_key, default_noise_key
+from lazy_imports import lazy_import
+
+wavfile = lazy_import("scipy.io.wavfile")  # scipy.io alone costs more to import than the rest of the module
+
+# Settings
+default_sample_rate = 44100
+partial_amplitudes = [1.0, 0.2, 0.1, 0.05]  # fundamental and overtones of the flute voice
+
+# Preview renders start playing almost instantly; the full render replaces them for replay/download
+render_qualities = {
+    'preview': {'sample_rate': 22050, 'n_partials': 2},
+    'full': {'sample_rate': default_sample_rate, 'n_partials': len(partial_amplitudes)},
+}
+
+note_freq_base = {
+    'S': 261.63, 'R': 293.66, 'G': 329.63, 'M': 349.23,
+    'P': 392.00, 'D': 440.00, 'N': 493.88
+}
+octave_multipliers = {'low': 0.5, 'medium': 1.0, 'high': 2.0}
+
+# Whole-melody renders work on runs of notes of about this many samples to bound peak memory
+vectorised_chunk_samples = 1 << 20
+# Ensemble mixes synthesise their note events this many samples at a time
+parts_block_samples = 1 << 16
+# Each cache of rendered audio (melodies, ensembles) holds at most this many encoded bytes
+audio_cache_bytes = 256 * 1024 ** 2
+
+def generate_note_wave_flute_natural_vibrato(note, duration, octave='medium', fade_duration=0.01,
+                                             vibrato_depth=0.001, vibrato_speed=2.5, add_swell=True,
+                                             sample_rate=default_sample_rate,
+                                             n_partials=len(partial_amplitudes),
+                                             noise_seed=default_noise_key, start_sample=0):
+    t = np.linspace(0, duration, int(sample_rate * duration), False)
+    if note == '-' or note not in note_freq_base:
+        tone = np.zeros_like(t)
+    else:
+        base_freq = note_freq_base[note] * octave_multipliers[octave]
+        vibrato = vibrato_depth * np.sin(2 * np.pi * vibrato_speed * t)
+        phase = 2 * np.pi * base_freq * t + vibrato
+        tone = 0.003 * breath_noise(noise_seed, start_sample, len(t))
+        for harmonic, amplitude in enumerate(partial_amplitudes[:n_partials], start=1):
+            tone += amplitude * np.sin(harmonic * phase)
+
+    if add_swell and note != '-':
+        swell = np.sin(np.pi * t / duration)
+        tone *= swell
+
+    n_samples = len(tone)
+    n_fade = int(sample_rate * fade_duration)
+    n_fade = min(n_fade, n_samples // 2)
+    fade_in = np.linspace(0.0, 1.0, n_fade)
+    fade_out = np.linspace(1.0, 0.0, n_fade)
+    tone[:n_fade] *= fade_in
+    tone[-n_fade:] *= fade_out
+
+    tone *= 32767 / np.max(np.abs(tone) + 1e-5)
+    return tone.astype(np.int16)
+
+def parse_notes_input(note_string):
+    parsed_sequence = []
+    entry = note_string.strip()
+    i = 0
+    while i < len(entry):
+        if entry[i] in [',', '-']:
+            parsed_sequence.append(('-', 1, 'medium'))
+            i += 1
+        else:
+            note = entry[i]
+            i += 1
+            if note not in note_freq_base:
+                continue  # Skip invalid notes
+            octave = 'medium'
+            if i < len(entry) and entry[i] == '>':
+                octave = 'high'
+                i += 1
+            elif i < len(entry) and entry[i] == '<':
+                octave = 'low'
+                i += 1
+            count = 0
+            while i < len(entry) and entry[i] == '_':
+                count += 1
+                i += 1
+            duration = 1 + count
+            parsed_sequence.append((note, duration, octave))
+    return parsed_sequence
+
+def parse_parts_input(parts_string):
+    # Parallel parts, one per line or separated by '|', all starting together on one timeline.
+    # A part may start with a gain, e.g. "0.4:S_______" for a soft sustained Sa; the default is 1.
+    # Raises ValueError for a gain that is negative, infinite or NaN.
+    parts = []
+    for part in parts_string.replace('|', '\n').splitlines():
+        gain = 1.0
+        prefix, separator, notes = part.partition(':')
+        if separator:
+            try:
+                gain = float(prefix)
+                part = notes
+            except ValueError:
+                pass  # Not a gain; the parser skips the stray characters
+            if not np.isfinite(gain) or gain < 0:
+                raise ValueError(f"Invalid gain {prefix.strip()!r}: use a number of 0 or more, e.g. 0.5")
+        parsed_sequence = parse_notes_input(part)
+        if parsed_sequence:
+            parts.append((parsed_sequence, gain))
+    return parts
+
+def bpm_to_duration(bpm, note_length=1):
+    return (60.0 / bpm) * note_length
+
+def normalize_sequence(parsed_sequence):
+    # Canonical notation of a parsed sequence, e.g. "DS>DP-GRSR"
+    octave_marks = {'low': '<', 'medium': '', 'high': '>'}
+    return ''.join('-' if note == '-' else f"{note}{octave_marks[octave]}{'_' * (multiplier - 1)}"
+                   for note, multiplier, octave in parsed_sequence)
+
+def melody_hash(parsed_sequence, bpm):
+    # Identifies the rendered audio of a melody: same notes and tempo, same hash
+    return hashlib.sha256(f"{normalize_sequence(parsed_sequence)}@{bpm}".encode()).hexdigest()
+
+def melody_noise_seed(parsed_sequence, bpm):
+    # Breath noise is keyed by the melody, so the same melody always renders to the same bytes
+    return noise_key(melody_hash(parsed_sequence, bpm))
+
+def part_noise_seed(parsed_sequence, bpm, part_index):
+    # Ensemble parts are also keyed by their position, so identical unison parts get independent noise
+    return noise_key(hashlib.sha256(f"{melody_hash(parsed_sequence, bpm)}#{part_index}".encode()).hexdigest())
+
+def play_notes_sequence(parsed_sequence, bpm=60, sample_rate=default_sample_rate,
+                        n_partials=len(partial_amplitudes), noise_seed=None):
+    if noise_seed is None:
+        noise_seed = melody_noise_seed(parsed_sequence, bpm)
+    full_wave = np.array([], dtype=np.int16)
+    for note_entry, multiplier, octave in parsed_sequence:
+        duration = bpm_to_duration(bpm, multiplier)
+        wave = generate_note_wave_flute_natural_vibrato(note_entry, duration, octave,
+                                                        sample_rate=sample_rate, n_partials=n_partials,
+                                                        noise_seed=noise_seed, start_sample=len(full_wave))
+        full_wave = np.concatenate((full_wave, wave))
+    return full_wave
+
+def render_sequence_vectorised(parsed_sequence, bpm=60, sample_rate=default_sample_rate,
+                               n_partials=len(partial_amplitudes), fade_duration=0.01,
+                               vibrato_depth=0.001, vibrato_speed=2.5, noise_seed=None):
+    # Same voice as generate_note_wave_flute_natural_vibrato, but the melody is expanded into
+    # per-sample frequency and envelope arrays and synthesised in a handful of ufunc calls
+    full_wave = np.zeros(sequence_samples(parsed_sequence, bpm, sample_rate), dtype=np.int16)
+    sample_offset = 0
+    for block in iter_sequence_vectorised(parsed_sequence, bpm, sample_rate, n_partials, fade_duration,
+                                          vibrato_depth, vibrato_speed, noise_seed):
+        full_wave[sample_offset:sample_offset + len(block)] = block
+        sample_offset += len(block)
+    return full_wave
+
+def sequence_samples(parsed_sequence, bpm, sample_rate=default_sample_rate):
+    return sum(int(sample_rate * bpm_to_duration(bpm, multiplier)) for _, multiplier, _ in parsed_sequence)
+
+def iter_sequence_vectorised(parsed_sequence, bpm=60, sample_rate=default_sample_rate,
+                             n_partials=len(partial_amplitudes), fade_duration=0.01, vibrato_depth=0.001,
+                             vibrato_speed=2.5, noise_seed=None, block_samples=None):
+    # Yields the melody as consecutive int16 blocks of whole notes, about block_samples long
+    # (a note longer than that is a block of its own)
+    block_samples = block_samples or vectorised_chunk_samples
+    counts = np.array([int(sample_rate * bpm_to_duration(bpm, multiplier))
+                       for _, multiplier, _ in parsed_sequence], dtype=np.int64)
+    freqs = np.array([note_freq_base[note] * octave_multipliers[octave] if note in note_freq_base else 0.0
+                      for note, _, octave in parsed_sequence])
+    if noise_seed is None:
+        noise_seed = melody_noise_seed(parsed_sequence, bpm)
+
+    # Each note starts at the phase the previous notes accumulated, so consecutive notes join without
+    # a phase jump; computing it per note keeps the output independent of where chunks are cut
+    note_phases = np.cumsum(freqs * counts) - freqs * counts
+    note_phases *= 2 * np.pi / sample_rate
+    note_phases %= 2 * np.pi
+    chunk_start_note = 0
+    sample_offset = 0
+    chunk_ends = np.cumsum(counts)
+    while chunk_start_note < len(counts):
+        limit = sample_offset + block_samples
+        chunk_end_note = max(int(np.searchsorted(chunk_ends, limit, side='right')), chunk_start_note + 1)
+        chunk = slice(chunk_start_note, chunk_end_note)
+        n_chunk = int(counts[chunk].sum())
+        if n_chunk:
+            yield _render_chunk(counts[chunk], freqs[chunk], note_phases[chunk], sample_offset, sample_rate,
+                                n_partials, fade_duration, vibrato_depth, vibrato_speed, noise_seed)
+        sample_offset += n_chunk
+        chunk_start_note = chunk_end_note
+
+def _render_chunk(counts, freqs, note_phases, sample_offset, sample_rate, n_partials,
+                  fade_duration, vibrato_depth, vibrato_speed, noise_seed):
+    total = int(counts.sum())
+    starts = np.cumsum(counts) - counts
+    local = np.arange(total, dtype=np.float64)
+    local -= np.repeat(starts, counts)
+
+    phase = np.repeat(freqs * (2 * np.pi / sample_rate), counts)
+    phase *= local
+    phase += np.repeat(note_phases, counts)
+    scratch = np.arange(sample_offset, sample_offset + total, dtype=np.float64)
+    scratch *= 2 * np.pi * vibrato_speed / sample_rate
+    np.sin(scratch, out=scratch)
+    scratch *= vibrato_depth
+    phase += scratch
+
+    # Overtones by the Chebyshev recurrence sin((k+1)x) = 2cos(x)sin(kx) - sin((k-1)x):
+    # one sin and one cos for the whole mix instead of one sin per partial
+    tone = breath_noise(noise_seed, sample_offset, total)
+    tone *= 0.003
+    two_cos = np.cos(phase)
+    two_cos *= 2
+    previous = np.zeros(total)
+    current = np.sin(phase)
+    for amplitude in partial_amplitudes[:n_partials]:
+        np.multiply(current, amplitude, out=scratch)
+        tone += scratch
+        np.multiply(two_cos, current, out=scratch)
+        scratch -= previous
+        previous, current, scratch = current, scratch, previous
+
+    # Half-sine swell over every note
+    envelope = local
+    envelope *= np.repeat(np.pi / np.maximum(counts, 1), counts)
+    np.sin(envelope, out=envelope)
+
+    # Linear fade-in/out, applied only to the first and last samples of each note
+    n_fade = np.minimum(int(sample_rate * fade_duration), counts // 2)
+    ramp = np.arange(int(n_fade.sum())) - np.repeat(np.cumsum(n_fade) - n_fade, n_fade)
+    gain = ramp / np.repeat(np.maximum(n_fade - 1, 1), n_fade)
+    envelope[np.repeat(starts, n_fade) + ramp] *= gain
+    envelope[np.repeat(starts + counts - 1, n_fade) - ramp] *= gain
+    tone *= envelope
+
+    # Each note is normalised to full scale on its own, as in the per-note generator; rests are silenced
+    non_empty = counts > 0
+    np.abs(tone, out=scratch)
+    peaks = np.zeros(len(counts))
+    peaks[non_empty] = np.maximum.reduceat(scratch, starts[non_empty])
+    scale = np.where(freqs > 0, 32767 / (peaks + 1e-5), 0.0)
+    tone *= np.repeat(scale, counts)
+    return tone.astype(np.int16)
+
+def render_sequence_grouped(parsed_sequence, bpm=60, sample_rate=default_sample_rate,
+                            n_partials=len(partial_amplitudes), fade_duration=0.01,
+                            vibrato_depth=0.001, vibrato_speed=2.5, noise_seed=None, stats=None):
+    # Each distinct (swara, octave, beat length) is synthesised once; distinct pitches of the same
+    # length are stacked into one 2-D array and rendered by a single broadcast call
+    counts = [int(sample_rate * bpm_to_duration(bpm, multiplier)) for _, multiplier, _ in parsed_sequence]
+    starts = np.cumsum([0] + counts[:-1])
+    full_wave = np.zeros(sum(counts), dtype=np.int16)
+    if noise_seed is None:
+        noise_seed = melody_noise_seed(parsed_sequence, bpm)
+
+    instances = {}
+    for (note, multiplier, octave), start, n in zip(parsed_sequence, starts, counts):
+        if note in note_freq_base and n > 0:
+            instances.setdefault((note, octave, n), []).append(start)
+
+    by_length = {}
+    for note, octave, n in instances:
+        by_length.setdefault(n, []).append((note, octave))
+
+    for n, pitches in by_length.items():
+        tones, envelope, scales = _normalised_group(pitches, n, sample_rate, n_partials, fade_duration,
+                                                    vibrato_depth, vibrato_speed)
+        for row, (note, octave) in enumerate(pitches):
+            noise_envelope = envelope * (0.003 * scales[row])
+            for start in instances[(note, octave, n)]:
+                full_wave[start:start + n] = _grouped_instance(tones[row], noise_envelope, noise_seed, int(start))
+
+    if stats is not None:
+        stats.update({
+            'notes': len(parsed_sequence),
+            'pitched_instances': sum(len(offsets) for offsets in instances.values()),
+            'unique_events': len(instances),
+            'synthesis_calls': len(by_length),
+        })
+    return full_wave
+
+def iter_sequence_grouped(parsed_sequence, bpm=60, sample_rate=default_sample_rate,
+                          n_partials=len(partial_amplitudes), fade_duration=0.01, vibrato_depth=0.001,
+                          vibrato_speed=2.5, noise_seed=None, block_samples=None):
+    # Streaming form of render_sequence_grouped with the same output, in consecutive int16 blocks of
+    # whole notes as iter_sequence_vectorised cuts them. A length group is synthesised when its first
+    # note is due and dropped after its last one.
+    block_samples = block_samples or vectorised_chunk_samples
+    counts = [int(sample_rate * bpm_to_duration(bpm, multiplier)) for _, multiplier, _ in parsed_sequence]
+    if noise_seed is None:
+        noise_seed = melody_noise_seed(parsed_sequence, bpm)
+
+    pitches_by_length = {}
+    last_use = {}
+    for index, ((note, _, octave), n) in enumerate(zip(parsed_sequence, counts)):
+        if note in note_freq_base and n > 0:
+            pitches = pitches_by_length.setdefault(n, [])
+            if (note, octave) not in pitches:
+                pitches.append((note, octave))
+            last_use[n] = index
+
+    groups = {}
+    chunk_ends = np.cumsum(counts)
+    chunk_start_note = 0
+    sample_offset = 0
+    while chunk_start_note < len(counts):
+        limit = sample_offset + block_samples
+        chunk_end_note = max(int(np.searchsorted(chunk_ends, limit, side='right')), chunk_start_note + 1)
+        block = np.zeros(int(chunk_ends[chunk_end_note - 1]) - sample_offset, dtype=np.int16)
+        start = sample_offset
+        for index in range(chunk_start_note, chunk_end_note):
+            note, _, octave = parsed_sequence[index]
+            n = counts[index]
+            if note in note_freq_base and n > 0:
+                if n not in groups:
+                    groups[n] = _normalised_group(pitches_by_length[n], n, sample_rate, n_partials,
+                                                  fade_duration, vibrato_depth, vibrato_speed)
+                tones, envelope, scales = groups[n]
+                row = pitches_by_length[n].index((note, octave))
+                noise_envelope = envelope * (0.003 * scales[row])
+                block[start - sample_offset:start - sample_offset + n] = _grouped_instance(
+                    tones[row], noise_envelope, noise_seed, start)
+                if last_use[n] == index:
+                    del groups[n]
+            start += n
+        if len(block):
+            yield block
+        sample_offset = start
+        chunk_start_note = chunk_end_note
+
+def _normalised_group(pitches, n, sample_rate, n_partials, fade_duration, vibrato_depth, vibrato_speed):
+    # Clean tones of the (swara, octave) pitches sharing length n, each normalised to full scale,
+    # with their envelope and scale factors for the breath noise added per instance
+    freqs = np.array([note_freq_base[note] * octave_multipliers[octave] for note, octave in pitches])
+    tones, envelope = _batch_note_tones(freqs, n, sample_rate, n_partials, fade_duration,
+                                        vibrato_depth, vibrato_speed)
+    scales = 32767 / (np.abs(tones).max(axis=1) + 1e-5)
+    tones *= scales[:, None]
+    return tones, envelope, scales
+
+def _grouped_instance(tone, noise_envelope, noise_seed, start):
+    # Normalise on the clean tone, then add this instance's own breath noise on top
+    segment = breath_noise(noise_seed, start, len(tone))
+    segment *= noise_envelope
+    segment += tone
+    np.clip(segment, -32767, 32767, out=segment)
+    return segment
+
+def _batch_note_tones(freqs, n, sample_rate, n_partials, fade_duration, vibrato_depth, vibrato_speed):
+    # Clean (noise-free) tones of shape (len(freqs), n) and their shared envelope
+    t = np.arange(n) / sample_rate
+    phase = (2 * np.pi * freqs)[:, None] * t[None, :]
+    phase += vibrato_depth * np.sin(2 * np.pi * vibrato_speed * t)
+
+    two_cos = 2 * np.cos(phase)
+    previous = np.zeros_like(phase)
+    current = np.sin(phase)
+    tones = np.zeros_like(phase)
+    for amplitude in partial_amplitudes[:n_partials]:
+        tones += amplitude * current
+        previous, current = current, two_cos * current - previous
+
+    envelope = np.sin(np.pi * np.arange(n) / n)
+    n_fade = min(int(sample_rate * fade_duration), n // 2)
+    if n_fade:
+        ramp = np.linspace(0.0, 1.0, n_fade)
+        envelope[:n_fade] *= ramp
+        envelope[n - n_fade:] *= ramp[::-1]
+    tones *= envelope
+    return tones, envelope
+
+def render_parts(parts, bpm=60, sample_rate=default_sample_rate, n_partials=len(partial_amplitudes),
+                 fade_duration=0.01, vibrato_depth=0.001, vibrato_speed=2.5, block_samples=None, stats=None):
+    # Parallel parts on one shared timeline, mixed into a single float32 accumulator that is
+    # normalised once at the end. Note events are cut into pieces and synthesised a block of
+    # pieces at a time, so rests cost nothing, the work follows the note events rather than
+    # parts x duration, and the float64 temporaries never outgrow one block.
+    block_samples = block_samples or parts_block_samples
+    pieces = []  # (timeline start, offset into the note, length, note length, frequency, gain, noise seed)
+    note_events = 0
+    total = 0
+    for part_index, (parsed_sequence, gain) in enumerate(parts):
+        noise_seed = part_noise_seed(parsed_sequence, bpm, part_index)
+        start = 0
+        for note, multiplier, octave in parsed_sequence:
+            n = int(sample_rate * bpm_to_duration(bpm, multiplier))
+            if note in note_freq_base and n > 0 and gain:
+                note_events += 1
+                freq = note_freq_base[note] * octave_multipliers[octave]
+                for offset in range(0, n, block_samples):
+                    pieces.append((start + offset, offset, min(block_samples, n - offset), n, freq, gain, noise_seed))
+            start += n
+        total = max(total, start)
+    mix = np.zeros(total, dtype=np.float32)
+
+    blocks = 0
+    batch, batch_samples = [], 0
+    for piece in pieces + [None]:
+        if batch and (piece is None or batch_samples + piece[2] > block_samples):
+            _mix_pieces(mix, batch, sample_rate, n_partials, fade_duration, vibrato_depth, vibrato_speed)
+            blocks += 1
+            batch, batch_samples = [], 0
+        if piece is not None:
+            batch.append(piece)
+            batch_samples += piece[2]
+
+    # The single normalisation pass: the loudest moment of the mix goes to full scale
+    peak = max(float(mix.max()), -float(mix.min())) if total else 0.0  # no full-length abs() copy
+    if peak > 0:
+        mix *= 32767 / peak
+
+    if stats is not None:
+        stats.update({
+            'parts': len(parts),
+            'note_events': note_events,
+            'blocks': blocks,
+            'mixed_samples': sum(piece[2] for piece in pieces),
+            'timeline_samples': total,
+        })
+    return mix.astype(np.int16)
+
+def _mix_pieces(mix, pieces, sample_rate, n_partials, fade_duration, vibrato_depth, vibrato_speed):
+    # The voice of _batch_note_tones, evaluated at each piece's position within its note. Every
+    # note's envelope peaks at the same level, so they need no normalisation of their own.
+    lengths = np.array([piece[2] for piece in pieces])
+    total = int(lengths.sum())
+    piece_starts = np.cumsum(lengths) - lengths
+    local = np.arange(total, dtype=np.float64)
+    local += np.repeat(np.array([piece[1] for piece in pieces]) - piece_starts, lengths)
+    note_lengths = np.array([piece[3] for piece in pieces])
+
+    phase = np.repeat(np.array([piece[4] for piece in pieces]) * (2 * np.pi / sample_rate), lengths)
+    phase *= local
+    scratch = local * (2 * np.pi * vibrato_speed / sample_rate)
+    np.sin(scratch, out=scratch)
+    scratch *= vibrato_depth
+    phase += scratch
+
+    # Breath noise is keyed by the timeline position, as in render_sequence_grouped
+    tone = np.concatenate([breath_noise(noise_seed, start, length)
+                           for start, _, length, _, _, _, noise_seed in pieces])
+    tone *= 0.003
+    two_cos = np.cos(phase)
+    two_cos *= 2
+    previous = np.zeros(total)
+    current = np.sin(phase)
+    for amplitude in partial_amplitudes[:n_partials]:
+        np.multiply(current, amplitude, out=scratch)
+        tone += scratch
+        np.multiply(two_cos, current, out=scratch)
+        scratch -= previous
+        previous, current, scratch = current, scratch, previous
+
+    # Half-sine swell with linear fades at both ends of the note, times the part's gain
+    n = np.repeat(note_lengths, lengths).astype(np.float64)
+    ramp = np.repeat(np.maximum(np.minimum(int(sample_rate * fade_duration), note_lengths // 2) - 1, 1), lengths)
+    np.divide(local, n, out=previous)
+    previous *= np.pi
+    np.sin(previous, out=previous)
+    np.divide(local, ramp, out=scratch)
+    np.minimum(scratch, 1, out=scratch)
+    previous *= scratch
+    np.subtract(n - 1, local, out=scratch)
+    scratch /= ramp
+    np.minimum(scratch, 1, out=scratch)
+    previous *= scratch
+    previous *= np.repeat(np.array([piece[5] for piece in pieces]), lengths)
+    tone *= previous
+
+    for (start, _, length, _, _, _, _), offset in zip(pieces, piece_starts):
+        mix[start:start + length] += tone[offset:offset + length]
+
+renderers = {
+    'per_note': play_notes_sequence,
+    'vectorised': render_sequence_vectorised,
+    'grouped': render_sequence_grouped,
+}
+default_renderer = 'grouped'
+
+def encode_wav(audio_data, sample_rate):
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, audio_data)
+    return buffer.getvalue()
+
+def audio_cache(max_bytes=audio_cache_bytes):
+    # Least-recently-used cache of encoded audio bounded by the bytes it holds, not the entry count:
+    # one ten-minute melody weighs as much as hundreds of short ones. Results larger than max_bytes
+    # are returned without being cached.
+    def decorator(render_fn):
+        entries = collections.OrderedDict()
+        lock = threading.Lock()
+        held_bytes = 0
+
+        @functools.wraps(render_fn)
+        def cached(*args):
+            nonlocal held_bytes
+            with lock:
+                if args in entries:
+                    entries.move_to_end(args)
+                    return entries[args]
+            # Rendered outside the lock, so a long render does not hold up cache hits
+            audio_bytes = render_fn(*args)
+            if len(audio_bytes) > max_bytes:
+                return audio_bytes
+            with lock:
+                if args not in entries:
+                    entries[args] = audio_bytes
+                    held_bytes += len(audio_bytes)
+                while held_bytes > max_bytes:
+                    _, evicted = entries.popitem(last=False)
+                    held_bytes -= len(evicted)
+            return audio_bytes
+        return cached
+    return decorator
+
+def render_parts_wav(parts, bpm, sample_rate=default_sample_rate, n_partials=len(partial_amplitudes)):
+    # Rendered ensembles are cached for replays and downloads, keyed by every part's notes and gain
+    return _render_parts_wav_cached(tuple((tuple(parsed_sequence), gain) for parsed_sequence, gain in parts),
+                                    bpm, sample_rate, n_partials)
+
+@audio_cache()
+def _render_parts_wav_cached(parts, bpm, sample_rate, n_partials):
+    return encode_wav(render_parts(parts, bpm, sample_rate, n_partials), sample_rate)
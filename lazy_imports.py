@@ -0,0 +1,37 @@
+# Deferred imports for heavy modules, to cut the cold start of the apps.
+# lazy_import returns a stand-in at once and imports the real module on first attribute
+# access, so scipy, soundfile and the practice tools only load when someone needs them.
+# Set METRONOME_EAGER_IMPORTS=1 to import everything up front (benchmark_startup.py
+# compares both modes).
+
+import importlib
+import os
+
+eager_imports = os.environ.get("METRONOME_EAGER_IMPORTS") == "1"
+
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # Only called for attributes the stand-in lacks; the import system serialises
+        # concurrent first imports, so sessions racing here get the same module
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded yet"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def lazy_import(name):
+    if eager_imports:
+        return importlib.import_module(name)
+    return _LazyModule(name)
+
+def preload(*modules):
+    # Forces lazy stand-ins to load; used by warm-up so the first user does not pay for it
+    for module in modules:
+        if isinstance(module, _LazyModule) and module._module is None:
+            module._module = importlib.import_module(module._name)
@@ -0,0 +1,466 @@
+# Multi-session load test for the Streamlit entry points.
+# Simulates N concurrent students pressing Play, Generate Random Melody and Stop, and reports
+# rerun latency percentiles, render throughput, memory growth and cross-session interference.
+# Audio players are counted whatever form they take: st.audio, an HTML <audio> tag (v1 embeds
+# one in a components.html iframe) or v4's Web Audio browser synth. Server-side renders are
+# counted in apptest mode only: from the "render finished" records render_cost logs, and for
+# metronomev1, which renders without render_cost, from its soundfile.write calls.
+# metronomev1 only plays after its extra "Ready to Play" button, whose rerun blocks for the
+# whole melody; raise its tempo (--set "🎚️ Set BPM=180") for shorter runs.
+#
+# The default mode drives every session in-process with streamlit.testing.v1.AppTest, so
+# module-level state (caches, render slots, anything global) is shared exactly as on a real
+# server. AppTest swaps a process-global Runtime in and out around each run, so the sessions'
+# reruns are interleaved rather than overlapped: latencies are per-rerun service times and
+# throughput is what one script thread sustains. The websocket mode speaks Streamlit's
+# protocol to a running server (started here unless --url is given) for truly parallel load,
+# including the fragment auto-reruns a browser would send.
+#
+#   python load_test.py --sessions 10 --rounds 3
+#   python load_test.py metronomev4.py --sessions 20 --set "🔊 Playback:=Browser synth"
+#   python load_test.py metronomev4.py --mode websocket --sessions 50 --json
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from render_cost import logger as render_logger
+
+default_scripts = ["metronomev4.py", "metronomev1.py", "metronomewithoutaudio.py"]
+# Buttons are matched by the first label containing the keyword; apps without one skip it
+default_actions = ["Play", "Ready", "Random", "Stop"]
+latency_percentiles = [50, 90, 99]
+project_dir = os.path.dirname(os.path.abspath(__file__))
+# Saves from simulated sessions go to a scratch melody store, not the real one
+scratch_melody_db = os.path.join(project_dir, ".load_test_melodies.db")
+
+_apptest_lock = threading.Lock()
+
+def _find_button(buttons, keyword):
+    return next((button for button in buttons if keyword.lower() in button.lower()), None)
+
+def _rss_bytes(pid="self"):
+    # Current resident set size on Linux; None elsewhere
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def _plays_audio(html):
+    # An embedded <audio> tag, or the Web Audio player symbolic_transport sends
+    return '<audio' in html or 'AudioContext' in html
+
+def _audio_elements(at):
+    embedded = sum(_plays_audio(str(element.value)) for element in at.markdown)
+    framed = sum(_plays_audio(element.proto.srcdoc) for element in at.get('iframe'))
+    return len(at.get('audio')) + embedded + framed
+
+class _RenderCounter(logging.Handler):
+    # Counts the "render finished" records render_cost logs for every server-side render
+    def __init__(self):
+        super().__init__()
+        self.renders = 0
+        self.samples = 0
+
+    def emit(self, record):
+        if hasattr(record, 'render_samples'):
+            self.count(record.render_samples)
+
+    def count(self, samples):
+        with self.lock:
+            self.renders += 1
+            self.samples += samples
+
+    def counting_write(self, write):
+        # metronomev1 is re-executed on every run, so its create_audio_file cannot be patched from
+        # here; the soundfile.write call that ends each of its renders can
+        def counted_write(file, data, *args, **kwargs):
+            self.count(len(data))
+            return write(file, data, *args, **kwargs)
+        return counted_write
+
+# ---- AppTest mode ----
+
+def _timed_run(runnable):
+    # Runs of different AppTest sessions must not overlap (see the note at the top)
+    with _apptest_lock:
+        start = time.perf_counter()
+        at = runnable.run()
+        return at, time.perf_counter() - start
+
+def _click(at, label):
+    return _timed_run(next(button for button in at.button if button.label == label).click())
+
+def _apply_settings(at, settings):
+    # Like buttons, settings for a widget the app does not have are skipped
+    for label, value in settings.items():
+        widgets = [*at.radio, *at.checkbox, *at.selectbox, *at.text_input, *at.number_input, *at.slider]
+        widget = next((widget for widget in widgets if widget.label == label), None)
+        if widget is None:
+            continue
+        if isinstance(widget.value, bool):
+            value = value.lower() in ("1", "true", "yes", "on")
+        elif isinstance(widget.value, (int, float)):
+            value = type(widget.value)(value)
+        _timed_run(widget.set_value(value))
+
+def run_apptest_session(script, actions, rounds, think_seconds, settings, timeout, start_delay=0.0):
+    from streamlit.testing.v1 import AppTest
+
+    time.sleep(start_delay)
+    records = []
+    at, elapsed = _timed_run(AppTest.from_file(os.path.join(project_dir, script), default_timeout=timeout))
+    records.append({'action': 'load', 'seconds': elapsed, 'audio': 0, 'errors': len(at.exception)})
+    _apply_settings(at, settings)
+
+    for _ in range(rounds):
+        for action in actions:
+            label = _find_button([button.label for button in at.button], action)
+            if label is None:
+                records.append({'action': action, 'skipped': True})
+                continue
+            try:
+                _, elapsed = _click(at, label)
+                errors = len(at.exception)
+            except RuntimeError:
+                # AppTest raises when the script does not finish within the timeout
+                elapsed, errors = timeout, 1
+            records.append({'action': action, 'seconds': elapsed, 'audio': _audio_elements(at), 'errors': errors})
+            time.sleep(think_seconds)
+    return records
+
+def _fingerprint(at):
+    # What a student would notice: which buttons are offered, audio players and errors.
+    # Timer texts and fingering images change from second to second, so they are left out.
+    return {'buttons': sorted(button.label for button in at.button), 'audio': _audio_elements(at),
+            'errors': len(at.exception) + len(at.error)}
+
+def probe_interference(script, actions, settings, timeout):
+    # Session A starts a melody, then session B runs the whole action list (ending in Stop).
+    # A is rerun and compared with a control run where B never existed: any difference
+    # is state leaking between sessions, like the module-level stop_flag the apps used to share.
+    from streamlit.testing.v1 import AppTest
+
+    def new_session():
+        at, _ = _timed_run(AppTest.from_file(os.path.join(project_dir, script), default_timeout=timeout))
+        _apply_settings(at, settings)
+        return at
+
+    def press(at, action):
+        label = _find_button([button.label for button in at.button], action)
+        if label is not None:
+            _click(at, label)
+
+    session_a = new_session()
+    press(session_a, actions[0])
+    started = time.perf_counter()
+    session_b = new_session()
+    for action in actions:
+        press(session_b, action)
+    waited = time.perf_counter() - started
+    probe = _fingerprint(_timed_run(session_a)[0])
+
+    control_a = new_session()
+    press(control_a, actions[0])
+    time.sleep(waited)
+    control = _fingerprint(_timed_run(control_a)[0])
+    return {'isolated': probe == control, 'with_other_session': probe, 'alone': control}
+
+def run_apptest_load(script, sessions, actions, rounds, think_seconds, settings, timeout, ramp_up_seconds,
+                     trace_memory=False):
+    import soundfile
+
+    render_counter = _RenderCounter()
+    render_logger.addHandler(render_counter)
+    soundfile_write = soundfile.write
+    soundfile.write = render_counter.counting_write(soundfile_write)
+    if trace_memory:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+    rss_before = _rss_bytes()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as pool:
+        futures = [pool.submit(run_apptest_session, script, actions, rounds, think_seconds, settings, timeout,
+                               ramp_up_seconds * index / sessions) for index in range(sessions)]
+        records = [record for future in futures for record in future.result()]
+    wall_seconds = time.perf_counter() - start
+
+    memory = {'rss_growth_mb': None if rss_before is None else (_rss_bytes() - rss_before) / 2 ** 20}
+    if trace_memory:
+        # Allocations still alive after the run, by line in this project's modules
+        growth = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+        tracemalloc.stop()
+        memory['top_growth'] = [
+            {'where': f"{os.path.relpath(stat.traceback[0].filename, project_dir)}:{stat.traceback[0].lineno}",
+             'kib': stat.size_diff / 1024}
+            for stat in growth if stat.traceback[0].filename.startswith(project_dir)][:10]
+    render_logger.removeHandler(render_counter)
+    soundfile.write = soundfile_write
+    return records, wall_seconds, memory, {'renders': render_counter.renders, 'samples': render_counter.samples}
+
+# ---- Websocket mode ----
+
+class WebsocketSession:
+    def __init__(self, websocket, timeout):
+        self.websocket = websocket
+        self.timeout = timeout
+        self.buttons = {}
+        self.auto_reruns = {}
+        self.page_script_hash = ""
+
+    async def rerun(self, widget_id=None, fragment_id=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.page_script_hash = self.page_script_hash
+        if fragment_id:
+            client_state.fragment_id = fragment_id
+            client_state.is_auto_rerun = True
+        if widget_id:
+            widget = client_state.widget_states.widgets.add()
+            widget.id = widget_id
+            widget.trigger_value = True
+
+        start = time.perf_counter()
+        await self.websocket.send(message.SerializeToString())
+        audio = errors = 0
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self.websocket.recv(), self.timeout))
+            kind = forward.WhichOneof('type')
+            if kind == 'new_session':
+                self.page_script_hash = forward.new_session.page_script_hash
+                if not forward.new_session.fragment_ids_this_run:
+                    # A full run redraws the page; fragments register their auto-reruns again
+                    self.buttons = {}
+                    self.auto_reruns = {}
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'button':
+                    self.buttons[element.button.label] = element.button.id
+                elif (element_type == 'audio'
+                      or (element_type == 'markdown' and _plays_audio(element.markdown.body))
+                      or (element_type == 'iframe' and _plays_audio(element.iframe.srcdoc))):
+                    audio += 1
+                elif element_type == 'exception':
+                    errors += 1
+            elif kind == 'auto_rerun':
+                self.auto_reruns[forward.auto_rerun.fragment_id] = forward.auto_rerun.interval
+            elif kind == 'stop_auto_rerun':
+                for stopped in forward.stop_auto_rerun.fragment_ids:
+                    self.auto_reruns.pop(stopped, None)
+            elif kind == 'script_finished' and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return time.perf_counter() - start, audio, errors
+
+    async def think(self, seconds, records):
+        # Like the browser, keep firing fragment auto-reruns (playback timers) while idle
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            if not self.auto_reruns:
+                await asyncio.sleep(deadline - time.perf_counter())
+                return
+            interval = min(self.auto_reruns.values())
+            for fragment_id in list(self.auto_reruns):
+                elapsed, audio, errors = await self.rerun(fragment_id=fragment_id)
+                records.append({'action': 'fragment tick', 'seconds': elapsed, 'audio': audio, 'errors': errors})
+            await asyncio.sleep(max(0.0, min(interval, deadline - time.perf_counter())))
+
+async def _websocket_session(ws_url, actions, rounds, think_seconds, timeout, start_delay):
+    import websockets  # only needed for this mode
+
+    await asyncio.sleep(start_delay)
+    records = []
+    async with websockets.connect(ws_url, subprotocols=["streamlit"], max_size=None, open_timeout=timeout) as ws:
+        session = WebsocketSession(ws, timeout)
+        elapsed, _, errors = await session.rerun()
+        records.append({'action': 'load', 'seconds': elapsed, 'audio': 0, 'errors': errors})
+        for _ in range(rounds):
+            for action in actions:
+                label = _find_button(session.buttons, action)
+                if label is None:
+                    records.append({'action': action, 'skipped': True})
+                    continue
+                try:
+                    elapsed, audio, errors = await session.rerun(widget_id=session.buttons[label])
+                except asyncio.TimeoutError:
+                    elapsed, audio, errors = timeout, 0, 1
+                records.append({'action': action, 'seconds': elapsed, 'audio': audio, 'errors': errors})
+                await session.think(think_seconds, records)
+    return records
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def start_server(script, timeout=60, env=None):
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(project_dir, script), "--server.headless=true",
+         f"--server.port={port}", "--server.address=127.0.0.1", "--browser.gatherUsageStats=false"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return server, url
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError(f"Streamlit server for {script} did not come up on port {port}")
+
+def stream_url(url):
+    return url.replace("http", "ws", 1).rstrip("/") + "/_stcore/stream"
+
+def run_websocket_load(url, sessions, actions, rounds, think_seconds, timeout, ramp_up_seconds, server_pid=None):
+    ws_url = stream_url(url)
+    rss_before = _rss_bytes(server_pid) if server_pid else None
+
+    async def run_all():
+        return await asyncio.gather(*[
+            _websocket_session(ws_url, actions, rounds, think_seconds, timeout, ramp_up_seconds * index / sessions)
+            for index in range(sessions)])
+
+    start = time.perf_counter()
+    records = [record for session in asyncio.run(run_all()) for record in session]
+    wall_seconds = time.perf_counter() - start
+    memory = {'server_rss_growth_mb': None if rss_before is None else (_rss_bytes(server_pid) - rss_before) / 2 ** 20}
+    return records, wall_seconds, memory
+
+# ---- Report ----
+
+def summarise(records, wall_seconds):
+    summary = {}
+    for action in dict.fromkeys(record['action'] for record in records):
+        timed = [record for record in records if record['action'] == action and not record.get('skipped')]
+        row = {'runs': len(timed), 'skipped': sum(record['action'] == action and bool(record.get('skipped'))
+                                                  for record in records)}
+        if timed:
+            seconds = np.array([record['seconds'] for record in timed])
+            row.update({f"p{p}_s": float(np.percentile(seconds, p)) for p in latency_percentiles})
+            row['max_s'] = float(seconds.max())
+            row['errors'] = sum(record['errors'] for record in timed)
+            row['audio_players'] = sum(record['audio'] > 0 for record in timed)
+        summary[action] = row
+    timed = [record for record in records if not record.get('skipped')]
+    totals = {
+        'wall_seconds': wall_seconds,
+        'reruns_per_second': len(timed) / wall_seconds,
+        'audio_players_per_second': sum(record['audio'] > 0 for record in timed) / wall_seconds,
+        'errors': sum(record['errors'] for record in timed),
+    }
+    return summary, totals
+
+def print_report(script, sessions, summary, totals, memory, interference=None, renders=None):
+    print(f"\n[{script}] {sessions} sessions, {totals['wall_seconds']:.1f}s wall")
+    print(f"{'action':>16} {'runs':>5} {'skip':>5} " + ' '.join(f"{f'p{p} s':>8}" for p in latency_percentiles)
+          + f" {'max s':>8} {'errors':>6} {'audio':>6}")
+    for action, row in summary.items():
+        if not row['runs']:
+            print(f"{action:>16} {0:>5} {row['skipped']:>5}")
+            continue
+        print(f"{action:>16} {row['runs']:>5} {row['skipped']:>5} "
+              + ' '.join(f"{row[f'p{p}_s']:>8.3f}" for p in latency_percentiles)
+              + f" {row['max_s']:>8.3f} {row['errors']:>6} {row['audio_players']:>6}")
+    print(f"Throughput: {totals['reruns_per_second']:.2f} reruns/s, "
+          f"{totals['audio_players_per_second']:.2f} audio players/s")
+    if renders is not None:
+        print(f"Server-side renders: {renders['renders']} ({renders['renders'] / totals['wall_seconds']:.2f} renders/s, "
+              f"{renders['samples'] / totals['wall_seconds']:.0f} samples/s)")
+    for key, value in memory.items():
+        if key == 'top_growth':
+            print("Memory still allocated after the run, by line:")
+            for stat in value:
+                print(f"  {stat['kib']:>10.1f} KiB  {stat['where']}")
+        elif value is not None:
+            print(f"Memory: {key} = {value:.1f}")
+    if interference is not None:
+        if interference['isolated']:
+            print("Cross-session interference: none (another session's actions left this one unchanged)")
+        else:
+            print("Cross-session interference: DETECTED")
+            print(f"  alone:              {interference['alone']}")
+            print(f"  with other session: {interference['with_other_session']}")
+
+def _parse_settings(pairs):
+    settings = {}
+    for pair in pairs or []:
+        label, _, value = pair.rpartition("=")
+        settings[label] = value
+    return settings
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit apps with many concurrent sessions.")
+    parser.add_argument("scripts", nargs="*", default=default_scripts, help="App scripts to test.")
+    parser.add_argument("--mode", choices=["apptest", "websocket"], default="apptest")
+    parser.add_argument("--sessions", type=int, default=5, help="Concurrent simulated sessions.")
+    parser.add_argument("--rounds", type=int, default=2, help="Times each session runs the action list.")
+    parser.add_argument("--action", action="append", help="Button keyword to press (repeatable, default: "
+                                                          + ", ".join(default_actions) + ").")
+    parser.add_argument("--think", type=float, default=0.5, help="Seconds between a session's actions.")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="Seconds over which sessions start.")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before a rerun counts as failed.")
+    parser.add_argument("--set", action="append", metavar="LABEL=VALUE",
+                        help="Set a widget before the actions, e.g. '🔊 Playback:=Browser synth' (apptest mode).")
+    parser.add_argument("--url", help="Running server to target in websocket mode (one script only).")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Report allocations still alive after the run, by line (slower).")
+    parser.add_argument("--no-interference", action="store_true", help="Skip the cross-session probe.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    actions = args.action or default_actions
+    settings = _parse_settings(args.set)
+    os.environ.setdefault("MELODY_DB_PATH", scratch_melody_db)
+    results = {}
+    for script in args.scripts:
+        renders = interference = None
+        if args.mode == "apptest":
+            records, wall_seconds, memory, renders = run_apptest_load(
+                script, args.sessions, actions, args.rounds, args.think, settings, args.timeout, args.ramp_up,
+                args.trace_memory)
+            if not args.no_interference:
+                interference = probe_interference(script, actions, settings, args.timeout)
+        else:
+            server = None
+            url = args.url
+            if url is None:
+                server, url = start_server(script)
+            try:
+                records, wall_seconds, memory = run_websocket_load(
+                    url, args.sessions, actions, args.rounds, args.think, args.timeout, args.ramp_up,
+                    server.pid if server else None)
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+        summary, totals = summarise(records, wall_seconds)
+        results[script] = {'summary': summary, 'totals': totals, 'memory': memory,
+                           'interference': interference, 'renders': renders}
+        if not args.json:
+            print_report(script, args.sessions, summary, totals, memory, interference, renders)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# SQLite-backed melody store replacing the saved_melodies.txt rewrites.
+# Writes are append-only inserts in WAL mode, melodies are deduplicated by content hash,
+# and an n-gram index over the swara sequence keeps phrase search fast on large stores.
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flute_synth import parse_notes_input, normalize_sequence, melody_hash
+
+melody_db_path = os.environ.get("MELODY_DB_PATH", "saved_melodies.db")
+ngram_size = 3
+
+_schema = """
+CREATE TABLE IF NOT EXISTS melodies (
+    id INTEGER PRIMARY KEY,
+    melody TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    swaras TEXT NOT NULL,
+    bpm INTEGER NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS melody_tags (
+    tag TEXT NOT NULL,
+    melody_id INTEGER NOT NULL REFERENCES melodies(id),
+    PRIMARY KEY (tag, melody_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS melody_ngrams (
+    gram TEXT NOT NULL,
+    melody_id INTEGER NOT NULL REFERENCES melodies(id),
+    PRIMARY KEY (gram, melody_id)
+) WITHOUT ROWID;
+"""
+
+# The schema and WAL mode persist in the database file, so they are set up once per process and path
+_initialised_paths = set()
+_initialise_lock = threading.Lock()
+
+@contextmanager
+def _connection(db_path=None):
+    # Streamlit runs every rerun on a fresh thread and sqlite3 connections are bound to the thread
+    # that opened them, so each call opens its own connection and closes it when done
+    db_path = db_path or melody_db_path
+    connection = sqlite3.connect(db_path, timeout=10)
+    try:
+        with _initialise_lock:
+            if db_path not in _initialised_paths:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(_schema)
+                _initialised_paths.add(db_path)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA synchronous=NORMAL")
+        yield connection
+    finally:
+        connection.close()
+
+def swara_tokens(parsed_sequence):
+    # Pitched notes only, with their octave mark: durations and rests do not break a phrase
+    octave_marks = {'low': '<', 'medium': '', 'high': '>'}
+    return [f"{note}{octave_marks[octave]}" for note, _, octave in parsed_sequence if note != '-']
+
+def _ngrams(tokens):
+    return {' '.join(tokens[i:i + ngram_size]) for i in range(len(tokens) - ngram_size + 1)}
+
+def save_melody(melody, bpm, tags=(), db_path=None):
+    parsed_sequence = parse_notes_input(melody)
+    if not parsed_sequence:
+        return None
+    tokens = swara_tokens(parsed_sequence)
+    content_hash = melody_hash(parsed_sequence, bpm)
+    with _connection(db_path) as connection, connection:
+        connection.execute(
+            "INSERT OR IGNORE INTO melodies (melody, normalized, swaras, bpm, content_hash, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (melody, normalize_sequence(parsed_sequence), f" {' '.join(tokens)} ", bpm, content_hash, time.time()))
+        melody_id = connection.execute("SELECT id FROM melodies WHERE content_hash = ?",
+                                       (content_hash,)).fetchone()['id']
+        connection.executemany("INSERT OR IGNORE INTO melody_ngrams (gram, melody_id) VALUES (?, ?)",
+                               [(gram, melody_id) for gram in _ngrams(tokens)])
+        connection.executemany("INSERT OR IGNORE INTO melody_tags (tag, melody_id) VALUES (?, ?)",
+                               [(tag.strip().lower(), melody_id) for tag in tags if tag.strip()])
+    return content_hash
+
+def _rows_with_tags(connection, rows):
+    melodies = []
+    for row in rows:
+        tags = [tag['tag'] for tag in connection.execute(
+            "SELECT tag FROM melody_tags WHERE melody_id = ? ORDER BY tag", (row['id'],))]
+        melodies.append({'melody': row['melody'], 'normalized': row['normalized'], 'bpm': row['bpm'],
+                         'tags': ', '.join(tags), 'content_hash': row['content_hash']})
+    return melodies
+
+def find_melodies_containing(phrase, limit=50, db_path=None):
+    tokens = swara_tokens(parse_notes_input(phrase))
+    if not tokens:
+        return []
+    needle = f" {' '.join(tokens)} "
+    grams = sorted(_ngrams(tokens))
+    with _connection(db_path) as connection:
+        if grams:
+            # Candidates must carry every n-gram of the phrase; instr() then checks they are contiguous
+            placeholders = ', '.join('?' * len(grams))
+            rows = connection.execute(
+                "SELECT m.* FROM melodies m JOIN ("
+                f"  SELECT melody_id FROM melody_ngrams WHERE gram IN ({placeholders})"
+                "   GROUP BY melody_id HAVING COUNT(*) = ?"
+                ") g ON g.melody_id = m.id "
+                "WHERE instr(m.swaras, ?) > 0 ORDER BY m.id DESC LIMIT ?",
+                (*grams, len(grams), needle, limit)).fetchall()
+        else:
+            rows = connection.execute(
+                "SELECT * FROM melodies WHERE instr(swaras, ?) > 0 ORDER BY id DESC LIMIT ?",
+                (needle, limit)).fetchall()
+        return _rows_with_tags(connection, rows)
+
+def find_melodies_by_tag(tag, limit=50, db_path=None):
+    with _connection(db_path) as connection:
+        rows = connection.execute(
+            "SELECT m.* FROM melodies m JOIN melody_tags t ON t.melody_id = m.id "
+            "WHERE t.tag = ? ORDER BY m.id DESC LIMIT ?", (tag.strip().lower(), limit)).fetchall()
+        return _rows_with_tags(connection, rows)
+
+def recent_melodies(limit=20, db_path=None):
+    with _connection(db_path) as connection:
+        rows = connection.execute("SELECT * FROM melodies ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return _rows_with_tags(connection, rows)
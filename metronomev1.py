@@ -4,12 +4,13 @@ import random
 import time
 import io
 import base64
-from PIL import Image
-import soundfile as sf
 import streamlit.components.v1 as components
+from flute_synth import default_sample_rate
+from lazy_imports import lazy_import
+
+sf = lazy_import("soundfile")
 
 # Settings
-sample_rate = 44100
 note_freq_base = {
     'S': 261.63, 'R': 293.66, 'G': 329.63, 'M': 349.23,
     'P': 392.00, 'D': 440.00, 'N': 493.88
@@ -71,7 +72,7 @@ def parse_notes_input(note_string):
 def bpm_to_duration(bpm, note_length=1):
     return (60.0 / bpm) * note_length
 
-def generate_audio(note, octave, duration):
+def generate_audio(note, octave, duration, sample_rate=default_sample_rate):
     if note == '-':
         return np.zeros(int(sample_rate * duration))
     frequency = note_freq_base[note] * octave_multipliers[octave]
@@ -79,11 +80,27 @@ def generate_audio(note, octave, duration):
     audio_data = np.sin(2 * np.pi * frequency * t)
     return audio_data
 
-def create_audio_file(sequence, bpm):
-    full_audio_data = np.array([])
-    for note, mult, octave in sequence:
-        duration = bpm_to_duration(bpm, mult)
-        full_audio_data = np.concatenate((full_audio_data, generate_audio(note, octave, duration)))
+def generate_audio_vectorised(sequence, bpm, sample_rate=default_sample_rate):
+    # Whole melody at once: per-sample frequency from np.repeat, phase integrated in one cumsum
+    counts = [int(sample_rate * bpm_to_duration(bpm, mult)) for _, mult, _ in sequence]
+    freqs = [0.0 if note == '-' else note_freq_base[note] * octave_multipliers[octave]
+             for note, _, octave in sequence]
+    frequency = np.repeat(freqs, counts)
+    phase = np.cumsum(frequency)
+    phase -= frequency
+    phase *= 2 * np.pi / sample_rate
+    audio_data = np.sin(phase)
+    audio_data *= frequency > 0
+    return audio_data
+
+def create_audio_file(sequence, bpm, sample_rate=default_sample_rate, vectorised=True):
+    if vectorised:
+        full_audio_data = generate_audio_vectorised(sequence, bpm, sample_rate)
+    else:
+        full_audio_data = np.array([])
+        for note, mult, octave in sequence:
+            duration = bpm_to_duration(bpm, mult)
+            full_audio_data = np.concatenate((full_audio_data, generate_audio(note, octave, duration, sample_rate)))
     audio_file = io.BytesIO()
     sf.write(audio_file, full_audio_data, sample_rate, format="WAV")
     audio_file.seek(0)
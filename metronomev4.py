@@ -1,132 +1,166 @@
 # Updated Streamlit Flute Metronome App with Improvements and Enhancements
 
 import streamlit as st
-import numpy as np
 import random
 import time
-import io
-from scipy.io import wavfile
-from PIL import Image
-import threading
-import os
-import base64
+import bisect
+import streamlit.components.v1 as components
+from flute_synth import (note_freq_base, render_qualities, parse_notes_input, parse_parts_input, bpm_to_duration,
+                         render_parts_wav)
+from render_cost import admit_render, admit_parts_render, render_slot, record_render, submit_background_render
+from render_pipeline import render_audio, audio_mime_types
+from symbolic_transport import web_audio_player_html, export_midi
+from lazy_imports import lazy_import
+from melody_store import save_melody, find_melodies_containing, find_melodies_by_tag, recent_melodies
+from warmup import start_warm_up
 
 # Settings
-sample_rate = 44100
-saved_melodies = []
-stop_flag = threading.Event()
-
-note_freq_base = {
-    'S': 261.63, 'R': 293.66, 'G': 329.63, 'M': 349.23,
-    'P': 392.00, 'D': 440.00, 'N': 493.88
-}
-octave_multipliers = {'low': 0.5, 'medium': 1.0, 'high': 2.0}
+progress_refresh_seconds = 0.25
+pitch_tracker = lazy_import("pitch_tracker")  # only loaded once someone uploads a practice recording
+start_warm_up()  # first run after a deploy: fill the render caches in the background
 
 # GitHub-hosted images
 image_base_url = "https://raw.githubusercontent.com/surajdwivedi0307/surajmetronome/main/images/"
 
-def generate_note_wave_flute_natural_vibrato(note, duration, octave='medium', fade_duration=0.01,
-                                             vibrato_depth=0.001, vibrato_speed=2.5, add_swell=True):
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    if note == '-' or note not in note_freq_base:
-        tone = np.zeros_like(t)
+def play_audio_in_streamlit(audio_bytes, audio_format='wav'):
+    st.audio(audio_bytes, format=audio_mime_types[audio_format])
+
+def show_player(player):
+    # Emitted at the same place on every full rerun while the melody plays, so the browser keeps the
+    # same player (and its sound) instead of dropping it when another widget is used
+    if 'html' in player:
+        components.html(player['html'], height=60)
     else:
-        base_freq = note_freq_base[note] * octave_multipliers[octave]
-        vibrato = vibrato_depth * np.sin(2 * np.pi * vibrato_speed * t)
-        phase = 2 * np.pi * base_freq * t + vibrato
-        fundamental = np.sin(phase)
-        overtone1 = 0.2 * np.sin(2 * phase)
-        overtone2 = 0.1 * np.sin(3 * phase)
-        overtone3 = 0.05 * np.sin(4 * phase)
-        noise = 0.003 * np.random.normal(0, 1, len(t))
-        tone = fundamental + overtone1 + overtone2 + overtone3 + noise
-
-    if add_swell and note != '-':
-        swell = np.sin(np.pi * t / duration)
-        tone *= swell
-
-    n_samples = len(tone)
-    n_fade = int(sample_rate * fade_duration)
-    n_fade = min(n_fade, n_samples // 2)
-    fade_in = np.linspace(0.0, 1.0, n_fade)
-    fade_out = np.linspace(1.0, 0.0, n_fade)
-    tone[:n_fade] *= fade_in
-    tone[-n_fade:] *= fade_out
-
-    tone *= 32767 / np.max(np.abs(tone) + 1e-5)
-    return tone.astype(np.int16)
-
-def parse_notes_input(note_string):
-    parsed_sequence = []
-    entry = note_string.strip()
-    i = 0
-    while i < len(entry):
-        if entry[i] in [',', '-']:
-            parsed_sequence.append(('-', 1, 'medium'))
-            i += 1
-        else:
-            note = entry[i]
-            i += 1
-            if note not in note_freq_base:
-                continue  # Skip invalid notes
-            octave = 'medium'
-            if i < len(entry) and entry[i] == '>':
-                octave = 'high'
-                i += 1
-            elif i < len(entry) and entry[i] == '<':
-                octave = 'low'
-                i += 1
-            count = 0
-            while i < len(entry) and entry[i] == '_':
-                count += 1
-                i += 1
-            duration = 1 + count
-            parsed_sequence.append((note, duration, octave))
-    return parsed_sequence
-
-def bpm_to_duration(bpm, note_length=1):
-    return (60.0 / bpm) * note_length
-
-def play_audio_in_streamlit(audio_data):
-    buffer = io.BytesIO()
-    wavfile.write(buffer, sample_rate, audio_data)
-    st.audio(buffer.getvalue(), format='audio/wav')
-    return buffer
-
-def display_note_progress(parsed_sequence, bpm):
-    note_display = st.empty()
-    timer_display = st.empty()
-    image_display = st.empty()
-
-    total_duration = sum(bpm_to_duration(bpm, duration) for _, duration, _ in parsed_sequence)
-    elapsed_time = 0.0
+        play_audio_in_streamlit(player['audio'], player['audio_format'])
 
+def start_note_progress(parsed_sequence, bpm, player):
+    # The progress panel works out the current note from this timeline and start time,
+    # so playback never blocks the script and reruns do not restart it
+    starts, names, notes = [], [], []
+    elapsed_time = 0.0
     for note_entry, multiplier, octave in parsed_sequence:
-        if stop_flag.is_set():
-            break
+        starts.append(elapsed_time)
+        names.append(f"{note_entry} ({octave})" if note_entry != '-' else "Rest")
+        notes.append(note_entry)
+        elapsed_time += bpm_to_duration(bpm, multiplier)
+    st.session_state.playback = {'starts': starts, 'names': names, 'notes': notes,
+                                 'total_duration': elapsed_time, 'started_at': time.time(), 'player': player}
 
-        duration = bpm_to_duration(bpm, multiplier)
-        elapsed_time += duration
+# Only this fragment reruns while a melody plays: its timer and the Stop button leave the
+# rendering, library and practice sections of the script alone
+@st.fragment(run_every=progress_refresh_seconds)
+def note_progress_panel():
+    playback = st.session_state.get('playback')
+    if playback is None:
+        return
+    if st.button("⏹️ Stop"):
+        st.session_state.playback = None
+        st.rerun()
 
-        note_name = f"{note_entry} ({octave})" if note_entry != '-' else "Rest"
-        note_display.markdown(f"## 🎵 Playing: **{note_name}**")
-        timer_display.markdown(f"### ⏱️ Duration: {elapsed_time:.2f}/{total_duration:.2f} seconds")
+    elapsed_time = time.time() - playback['started_at']
+    if elapsed_time >= playback['total_duration']:
+        # A full rerun drops the fragment, so it stops ticking once the melody is over
+        st.session_state.playback = None
+        st.rerun()
 
-        if note_entry in note_freq_base:
-            img_url = f"{image_base_url}bansuri_notes_{note_entry}.png"
-            image_display.image(img_url, caption=f"{note_entry} fingering", use_container_width=True)
-        else:
-            image_display.empty()
+    index = bisect.bisect_right(playback['starts'], elapsed_time) - 1
+    note_entry = playback['notes'][index]
+    st.markdown(f"## 🎵 Playing: **{playback['names'][index]}**")
+    st.markdown(f"### ⏱️ Duration: {elapsed_time:.2f}/{playback['total_duration']:.2f} seconds")
+    if note_entry in note_freq_base:
+        img_url = f"{image_base_url}bansuri_notes_{note_entry}.png"
+        st.image(img_url, caption=f"{note_entry} fingering", use_container_width=True)
 
-        time.sleep(duration)
+def admit_with_feedback(admit, notes, bpm, quality):
+    # Returns the cost estimate and partial count to render with, or None if the render is refused
+    settings = render_qualities[quality]
+    decision, estimate = admit(notes, bpm, settings['sample_rate'])
+    if decision == 'reject':
+        st.error(f"This melody is too long to render ({estimate['duration_seconds']:.0f}s of audio). "
+                 "Try a higher BPM or a shorter sequence.")
+        return None
+    n_partials = settings['n_partials']
+    if decision == 'downgrade':
+        n_partials = min(n_partials, render_qualities['preview']['n_partials'])
+        st.warning(f"Long melody: rendering at {estimate['sample_rate']} Hz to keep the server responsive.")
+    elif decision == 'queue':
+        st.info("⏳ The server is busy, your melody is queued for rendering...")
+    return estimate, n_partials
 
-def play_notes_sequence(parsed_sequence, bpm=60):
-    full_wave = np.array([], dtype=np.int16)
-    for note_entry, multiplier, octave in parsed_sequence:
-        duration = bpm_to_duration(bpm, multiplier)
-        wave = generate_note_wave_flute_natural_vibrato(note_entry, duration, octave)
-        full_wave = np.concatenate((full_wave, wave))
-    return full_wave
+def render_in_slot(estimate, render, *args):
+    try:
+        with render_slot():
+            start = time.perf_counter()
+            audio_bytes = render(*args)
+            record_render(estimate, time.perf_counter() - start)
+    except TimeoutError:
+        st.error("The server is busy right now. Please try again in a moment.")
+        return None
+    return audio_bytes
+
+def render_with_admission(parsed_sequence, bpm, quality='full', audio_format='wav'):
+    # render_audio synthesises with the grouped renderer (admit_render's default model) while
+    # the encoder runs alongside
+    admitted = admit_with_feedback(admit_render, parsed_sequence, bpm, quality)
+    if admitted is None:
+        return None
+    estimate, n_partials = admitted
+    return render_in_slot(estimate, render_audio, parsed_sequence, bpm, estimate['sample_rate'], n_partials,
+                          audio_format)
+
+def render_parts_with_admission(parts, bpm):
+    admitted = admit_with_feedback(admit_parts_render, parts, bpm, 'full')
+    if admitted is None:
+        return None
+    estimate, n_partials = admitted
+    return render_in_slot(estimate, render_parts_wav, parts, bpm, estimate['sample_rate'], n_partials)
+
+def cancel_full_render():
+    # An upgrade still waiting in the background queue is dropped; one already rendering finishes
+    full_render = st.session_state.pop('full_render', None)
+    if full_render is not None:
+        full_render['future'].cancel()
+
+def start_full_quality_render(parsed_sequence, bpm, file_name, audio_format='wav'):
+    # Upgrades a preview to the full 44.1 kHz render in the background
+    cancel_full_render()
+    settings = render_qualities['full']
+    decision, _ = admit_render(parsed_sequence, bpm, settings['sample_rate'], 'grouped')
+    if decision in ('reject', 'downgrade'):
+        return
+    future = submit_background_render(render_audio, parsed_sequence, bpm, settings['sample_rate'],
+                                      settings['n_partials'], audio_format)
+    if future is None:
+        st.info("The server is busy, so only the preview quality is available for this melody.")
+        return
+    st.session_state.full_render = {
+        'future': future,
+        'file_name': file_name.replace('.wav', f'.{audio_format}'),
+        'audio_format': audio_format,
+    }
+
+def play_melody(parsed_sequence, bpm, file_name, download_label):
+    # A new play replaces the previous melody's audio and downloads; previews schedule their own below
+    cancel_full_render()
+    st.session_state.pop('download', None)
+    if playback_mode == "Browser synth":
+        # Only the note schedule is sent; the browser synthesises the flute voice
+        st.session_state.last_melody = {'sequence': parsed_sequence, 'bpm': bpm, 'file_name': file_name}
+        start_note_progress(parsed_sequence, bpm, {'html': web_audio_player_html(parsed_sequence, bpm)})
+        return
+
+    quality = 'preview' if preview_mode else 'full'
+    audio_bytes = render_with_admission(parsed_sequence, bpm, quality, audio_format)
+    if audio_bytes is None:
+        return
+    if preview_mode:
+        start_full_quality_render(parsed_sequence, bpm, file_name, audio_format)
+    start_note_progress(parsed_sequence, bpm, {'audio': audio_bytes, 'audio_format': audio_format})
+    if not preview_mode:
+        st.session_state.download = {
+            'audio': audio_bytes, 'audio_format': audio_format,
+            'file_name': file_name.replace('.wav', f'.{audio_format}'), 'label': download_label,
+        }
 
 def generate_random_melody(length=12):
     notes = ['S', 'R', 'G', 'M', 'P', 'D', 'N', '-']
@@ -140,10 +174,30 @@ def generate_random_melody(length=12):
         melody += f"{note}{octave}{underscore}{separator}"
     return melody
 
-def save_melodies_to_file(melodies, filename='saved_melodies.txt'):
-    with open(filename, 'w') as f:
-        for melody in melodies:
-            f.write(melody + '\n')
+def parse_parts_with_feedback(parts_input):
+    # Returns the parsed parts, or None after telling the user what is wrong with them
+    try:
+        parts = parse_parts_input(parts_input)
+    except ValueError as error:
+        st.error(str(error))
+        return None
+    if not parts:
+        st.error("Invalid parts. Please check your notes.")
+        return None
+    return parts
+
+def analyse_upload(recording):
+    # Returns the pitch analysis, or None after telling the student why there is none
+    try:
+        with st.spinner("Analysing your recording..."):
+            analysis = pitch_tracker.analyse_recording(recording)
+    except RuntimeError:
+        # soundfile raises RuntimeError (LibsndfileError) for corrupt or unsupported files
+        st.error("Could not read this recording. Please upload a valid WAV, FLAC or OGG file.")
+        return None
+    if analysis is None:
+        st.error("The recording is empty.")
+    return analysis
 
 # ---- Streamlit UI ----
 st.set_page_config(layout="wide")
@@ -152,47 +206,127 @@ st.write("Generate and play random melodies or input your own sequence!")
 
 bpm_input_user = st.number_input("Enter BPM:", min_value=1, max_value=200, value=60, help="Beats per minute for melody speed.")
 user_input = st.text_input("Enter sequence (e.g., SGRG_RSN):", "DS>DP,GRSR,G-GR,GPD_")
+playback_mode = st.radio("🔊 Playback:", ["Server audio", "Browser synth"], horizontal=True,
+                         help="Server audio streams a rendered WAV or FLAC file; the optional browser "
+                              "synth plays the notes with Web Audio in your browser instead.")
+audio_format = st.radio("💽 Audio format:", ["wav", "flac"], horizontal=True, format_func=str.upper,
+                        help="Used for server audio and downloads. FLAC files are about half the size "
+                             "and are encoded while the melody is still being synthesised.")
+preview_mode = playback_mode == "Server audio" and st.checkbox(
+    "⚡ Quick preview", value=True,
+    help="Start playing a lighter render right away; the full-quality audio "
+         "is prepared in the background for replay and download.")
 
 col1, col2 = st.columns([1, 1])
 with col1:
     st.markdown("#### 🎵 Control Panel")
     if st.button("▶️ Play Notes"):
-        stop_flag.clear()
         parsed_user = parse_notes_input(user_input)
         if not parsed_user:
             st.error("Invalid input sequence. Please check your notes.")
         else:
-            audio_data = play_notes_sequence(parsed_user, bpm_input_user)
-            play_audio_in_streamlit(audio_data)
-            display_note_progress(parsed_user, bpm_input_user)
-            buffer = io.BytesIO()
-            wavfile.write(buffer, sample_rate, audio_data)
-            st.download_button("💽 Download WAV", data=buffer.getvalue(),
-                               file_name="flute_sequence.wav", mime="audio/wav")
+            play_melody(parsed_user, bpm_input_user, "flute_sequence.wav", f"💽 Download {audio_format.upper()}")
 
 with col2:
     st.markdown("#### 🎶 Melody Generator")
-    if st.button("⏹️ Stop"):
-        stop_flag.set()
-
     if st.button("🎲 Generate Random Melody"):
-        stop_flag.clear()
         random_melody = generate_random_melody()
-        saved_melodies.append(random_melody)
+        save_melody(random_melody, bpm_input_user, tags=['random'])
         st.write(f"**Random Melody:** `{random_melody}`")
         parsed_random = parse_notes_input(random_melody)
-        audio_data = play_notes_sequence(parsed_random, bpm_input_user)
-        play_audio_in_streamlit(audio_data)
-        display_note_progress(parsed_random, bpm_input_user)
-
-        buffer = io.BytesIO()
-        wavfile.write(buffer, sample_rate, audio_data)
-        st.download_button("💽 Download Random Melody", data=buffer.getvalue(),
-                           file_name="random_melody.wav", mime="audio/wav")
-
-    if st.button("💾 Save All Generated Melodies"):
-        if saved_melodies:
-            save_melodies_to_file(saved_melodies)
-            st.success("All melodies saved to 'saved_melodies.txt'.")
+        play_melody(parsed_random, bpm_input_user, "random_melody.wav", "💽 Download Random Melody")
+
+    melody_tags = st.text_input("Tags (comma-separated):", "", help="Used to find the melody again later.")
+    if st.button("💾 Save Input Melody"):
+        if save_melody(user_input, bpm_input_user, tags=melody_tags.split(',')):
+            st.success("Melody saved to the library.")
         else:
-            st.warning("No melodies to save yet.")
+            st.warning("Nothing to save: the input sequence has no valid notes.")
+
+# ---- Player and note progress of the melody being played ----
+if st.session_state.get('playback') is not None:
+    show_player(st.session_state.playback['player'])
+    note_progress_panel()
+
+# ---- Melody library ----
+with st.expander("📚 Melody Library"):
+    search_phrase = st.text_input("Find melodies containing phrase (e.g., GRS):", "")
+    search_tag = st.text_input("…or with tag:", "")
+    if search_phrase.strip():
+        library_rows = find_melodies_containing(search_phrase)
+    elif search_tag.strip():
+        library_rows = find_melodies_by_tag(search_tag)
+    else:
+        library_rows = recent_melodies()
+    if library_rows:
+        st.dataframe(library_rows, use_container_width=True)
+    else:
+        st.info("No saved melodies match.")
+
+# ---- Ensemble parts: lead, harmony and drone on one timeline ----
+with st.expander("🎼 Ensemble Parts"):
+    st.write("One part per line (or separated by `|`), all starting together at the selected BPM. "
+             "Start a part with a gain to set its level, e.g. `0.4:S___` for a soft sustained Sa.")
+    parts_input = st.text_area("Parts:", "DS>DP,GRSR,G-GR,GPD_\n0.6:G-GR,GPD_DS>DP,GRSR\n0.4:S__________________")
+    if st.button("🎼 Render Ensemble"):
+        parts = parse_parts_with_feedback(parts_input)
+        if parts is not None:
+            ensemble_audio = render_parts_with_admission(parts, bpm_input_user)
+            if ensemble_audio is not None:
+                st.audio(ensemble_audio, format="audio/wav")
+                st.download_button("💽 Download Ensemble WAV", data=ensemble_audio,
+                                   file_name="ensemble_parts.wav", mime="audio/wav")
+
+# ---- Practice feedback ----
+with st.expander("🎤 Practice Feedback"):
+    st.write("Upload a recording of yourself playing the sequence above at the selected BPM.")
+    recording = st.file_uploader("Recording (WAV, FLAC or OGG):", type=["wav", "flac", "ogg"])
+    if recording is not None:
+        parsed_practice = parse_notes_input(user_input)
+        if not parsed_practice:
+            st.error("Invalid input sequence. Please check your notes.")
+        else:
+            analysis = analyse_upload(recording)
+            if analysis is not None:
+                feedback, offset = pitch_tracker.align_to_sequence(analysis, parsed_practice, bpm_input_user)
+                matched = sum(row['match'] for row in feedback)
+                st.metric("Notes played correctly", f"{matched}/{len(feedback)}")
+                st.caption(f"Started at {offset:.2f}s · analysed {analysis['duration']:.1f}s of audio "
+                           f"in {analysis['processing_seconds']:.2f}s")
+                st.dataframe(feedback, use_container_width=True)
+
+# ---- Downloads for browser playback ----
+last_melody = st.session_state.get('last_melody')
+if playback_mode == "Browser synth" and last_melody is not None:
+    st.markdown("#### 💽 Downloads")
+    st.download_button("🎼 Download MIDI", data=export_midi(last_melody['sequence'], last_melody['bpm']),
+                       file_name=last_melody['file_name'].replace('.wav', '.mid'), mime="audio/midi")
+    if st.button(f"🎧 Render {audio_format.upper()} for download"):
+        # Rendered like a server-audio play, so long melodies are downgraded or refused up front
+        audio_bytes = render_with_admission(last_melody['sequence'], last_melody['bpm'], 'full', audio_format)
+        if audio_bytes is not None:
+            st.session_state.download = {
+                'audio': audio_bytes, 'audio_format': audio_format,
+                'file_name': last_melody['file_name'].replace('.wav', f'.{audio_format}'),
+                'label': f"💽 Download {audio_format.upper()}",
+            }
+
+# ---- Download of the last full-quality render ----
+# Kept in session state so the button survives the reruns at the end of playback
+download = st.session_state.get('download')
+if download is not None:
+    st.download_button(download['label'], data=download['audio'], file_name=download['file_name'],
+                       mime=audio_mime_types[download['audio_format']])
+
+# ---- Full-quality upgrade of the last preview ----
+full_render = st.session_state.get('full_render')
+if full_render is not None:
+    st.markdown("#### 🎧 Full Quality")
+    if full_render['future'].done():
+        full_audio = full_render['future'].result()
+        full_format = full_render['audio_format']
+        st.audio(full_audio, format=audio_mime_types[full_format])
+        st.download_button(f"💽 Download Full Quality {full_format.upper()}", data=full_audio,
+                           file_name=full_render['file_name'], mime=audio_mime_types[full_format])
+    else:
+        st.info("⏳ Full-quality audio is still rendering. It will appear here on the next interaction.")
@@ -1,24 +1,22 @@
 import streamlit as st
-import numpy as np
 import random
 import time
-import threading
+import math
+import bisect
 
 # Constants
-sample_rate = 44100
 note_freq_base = {
     'S': 261.63, 'R': 293.66, 'G': 329.63, 'M': 349.23,
     'P': 392.00, 'D': 440.00, 'N': 493.88
 }
 octave_multipliers = {'low': 0.5, 'medium': 1.0, 'high': 2.0}
 image_base_url = "https://raw.githubusercontent.com/surajdwivedi0307/surajmetronome/main/images/"
-stop_flag = threading.Event()
+countdown_seconds = 3
+animation_refresh_seconds = 0.1
 
 # Session State
-if "countdown_started" not in st.session_state:
-    st.session_state.countdown_started = False
-if "sequence_to_play" not in st.session_state:
-    st.session_state.sequence_to_play = []
+if "playback" not in st.session_state:
+    st.session_state.playback = None
 if "bpm" not in st.session_state:
     st.session_state.bpm = 60
 
@@ -83,64 +81,81 @@ def parse_notes_input(note_string):
 def bpm_to_duration(bpm, note_length=1):
     return (60.0 / bpm) * note_length
 
-def show_countdown():
-    countdown_placeholder = st.empty()
-    for i in range(3, 0, -1):
-        countdown_placeholder.markdown(
-            f"<h1 style='text-align:center; color:#e74c3c; font-size:72px;'>⏳ {i}</h1>",
+def build_timeline(parsed_sequence, bpm):
+    timeline = []
+    start = 0.0
+    for note, multiplier, octave in parsed_sequence:
+        duration = bpm_to_duration(bpm, multiplier)
+        timeline.append({
+            'note': note,
+            'name': f"{note} ({octave})" if note != '-' else "Rest",
+            'start': start,
+            'duration': duration,
+        })
+        start += duration
+    return timeline, start
+
+def start_playback(parsed_sequence):
+    # Everything the animation shows is derived from this start time, so reruns never restart it
+    timeline, total_duration = build_timeline(parsed_sequence, st.session_state.bpm)
+    st.session_state.playback = {
+        'timeline': timeline,
+        'starts': [entry['start'] for entry in timeline],
+        'total_duration': total_duration,
+        'started_at': time.time() + countdown_seconds + 1,  # 3, 2, 1, then a second of "Start!"
+    }
+
+def show_countdown(remaining):
+    if remaining > 1:
+        st.markdown(
+            f"<h1 style='text-align:center; color:#e74c3c; font-size:72px;'>⏳ {math.ceil(remaining - 1)}</h1>",
+            unsafe_allow_html=True
+        )
+    else:
+        st.markdown(
+            f"<h1 style='text-align:center; color:#2ecc71; font-size:64px;'>🎼 Start!</h1>",
             unsafe_allow_html=True
         )
-        time.sleep(1)
-    countdown_placeholder.markdown(
-        f"<h1 style='text-align:center; color:#2ecc71; font-size:64px;'>🎼 Start!</h1>",
-        unsafe_allow_html=True
-    )
-    time.sleep(1)
-    countdown_placeholder.empty()
-
-def display_note_animation(parsed_sequence, bpm):
-    container_note = st.empty()
-    container_next = st.empty()
-    container_image = st.empty()
-    container_progress = st.empty()
-
-    total_notes = len(parsed_sequence)
-    total_duration = sum(bpm_to_duration(bpm, d) for _, d, _ in parsed_sequence)
-    elapsed = 0.0
-
-    for idx, (note, multiplier, octave) in enumerate(parsed_sequence):
-        if stop_flag.is_set():
-            break
 
-        duration = bpm_to_duration(bpm, multiplier)
-        note_name = f"{note} ({octave})" if note != '-' else "Rest"
-        next_note_name = ""
-        if idx + 1 < total_notes:
-            next_n, _, next_octave = parsed_sequence[idx + 1]
-            next_note_name = f"{next_n} ({next_octave})" if next_n != '-' else "Rest"
-
-        remaining_time = duration
-        start_time = time.time()
-        while time.time() - start_time < duration:
-            elapsed_time = time.time() - start_time
-            remaining_time = duration - elapsed_time
-            container_note.markdown(
-                f"<div class='note-box'>🎵 Now Playing: {note_name} &nbsp;&nbsp; ⏱️ {elapsed_time:.2f}s / {duration:.2f}s left</div>", 
-                unsafe_allow_html=True)
-            container_next.markdown(f"##### 🔜 Next: `{next_note_name}`" if next_note_name else "", unsafe_allow_html=True)
-
-            if note in note_freq_base:
-                image_url = f"{image_base_url}bansuri_notes_{note}.png"
-                container_image.image(image_url, caption=f"{note} fingering", use_container_width=True)
-            else:
-                container_image.empty()
-
-            progress = (elapsed + elapsed_time) / total_duration
-            container_progress.progress(min(progress, 1.0))
-
-            time.sleep(0.05)
-
-        elapsed += duration
+def display_note_animation(playback, elapsed):
+    timeline = playback['timeline']
+    idx = bisect.bisect_right(playback['starts'], elapsed) - 1
+    current = timeline[idx]
+    elapsed_time = elapsed - current['start']
+    next_note_name = timeline[idx + 1]['name'] if idx + 1 < len(timeline) else ""
+
+    st.markdown(
+        f"<div class='note-box'>🎵 Now Playing: {current['name']} &nbsp;&nbsp; ⏱️ {elapsed_time:.2f}s / {current['duration']:.2f}s left</div>",
+        unsafe_allow_html=True)
+    if next_note_name:
+        st.markdown(f"##### 🔜 Next: `{next_note_name}`", unsafe_allow_html=True)
+
+    if current['note'] in note_freq_base:
+        image_url = f"{image_base_url}bansuri_notes_{current['note']}.png"
+        st.image(image_url, caption=f"{current['note']} fingering", use_container_width=True)
+
+    st.progress(min(elapsed / playback['total_duration'], 1.0))
+
+# Only this fragment reruns while a melody plays: the Stop button and the animation ticks
+# leave the page config, styling and the rest of the script alone
+@st.fragment(run_every=animation_refresh_seconds)
+def playback_panel():
+    playback = st.session_state.playback
+    if playback is None:
+        return
+    if st.button("⏹️ Stop Playback"):
+        st.session_state.playback = None
+        st.rerun()
+
+    elapsed = time.time() - playback['started_at']
+    if elapsed >= playback['total_duration']:
+        # A full rerun drops the fragment, so it stops ticking once the melody is over
+        st.session_state.playback = None
+        st.rerun()
+    if elapsed < 0:
+        show_countdown(-elapsed)
+    else:
+        display_note_animation(playback, elapsed)
 
 # Melody Generator
 def generate_random_melody(length=12):
@@ -162,28 +177,18 @@ note_input = st.text_input("✍️ Enter melody sequence (e.g., SGRG_RSN):", "DS
 col1, col2 = st.columns([1, 1])
 with col1:
     if st.button("▶️ Play Input Sequence"):
-        stop_flag.clear()
         sequence = parse_notes_input(note_input)
         if not sequence:
             st.error("Invalid note sequence.")
         else:
-            st.session_state.sequence_to_play = sequence
-            st.session_state.countdown_started = True
+            start_playback(sequence)
 
 with col2:
     if st.button("🎲 Generate & Play Random Melody"):
-        stop_flag.clear()
         melody = generate_random_melody()
         st.success(f"Random Melody: `{melody}`")
-        sequence = parse_notes_input(melody)
-        st.session_state.sequence_to_play = sequence
-        st.session_state.countdown_started = True
-
-if st.button("⏹️ Stop Playback"):
-    stop_flag.set()
+        start_playback(parse_notes_input(melody))
 
 # Run Countdown and Playback
-if st.session_state.countdown_started and not stop_flag.is_set():
-    show_countdown()
-    display_note_animation(st.session_state.sequence_to_play, st.session_state.bpm)
-    st.session_state.countdown_started = False
+if st.session_state.playback is not None:
+    playback_panel()
@@ -0,0 +1,147 @@
+# Streaming pitch tracker for practice feedback on uploaded recordings.
+# The recording is read in overlapping blocks with soundfile and every block of frames
+# goes through a vectorised, FFT-based YIN estimator, so memory stays bounded by the
+# block size and multi-minute takes analyse faster than real time.
+
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from flute_synth import note_freq_base, octave_multipliers, bpm_to_duration
+from lazy_imports import lazy_import
+
+sf = lazy_import("soundfile")
+
+# Analysis settings
+frame_size = 2048
+hop_size = 512
+frames_per_block = 128
+yin_threshold = 0.15
+silence_rms = 0.01
+min_frequency = 100.0    # below low Sa
+max_frequency = 1100.0   # above high Ni
+tolerance_cents = 50.0
+
+swara_labels = [(note, octave) for octave in octave_multipliers for note in note_freq_base]
+_swara_log2 = np.log2([note_freq_base[note] * octave_multipliers[octave] for note, octave in swara_labels])
+
+def yin_pitch(frames, sample_rate):
+    n_frames, width = frames.shape
+    tau_min = max(2, int(sample_rate / max_frequency))
+    tau_max = min(width // 2, int(sample_rate / min_frequency))
+    taus = np.arange(tau_max + 1)
+
+    # Difference function d(tau) = E[0, W-tau) + E[tau, W) - 2 r(tau), with r from one FFT per frame
+    n_fft = 1 << (2 * width - 1).bit_length()
+    spectrum = np.fft.rfft(frames, n_fft, axis=1)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), n_fft, axis=1)[:, :tau_max + 1]
+    energy = np.zeros((n_frames, width + 1))
+    np.cumsum(frames.astype(np.float64) ** 2, axis=1, out=energy[:, 1:])
+    diff = energy[:, width - taus] + (energy[:, width:] - energy[:, taus]) - 2 * acf
+
+    # Cumulative mean normalised difference
+    cmnd = np.ones_like(diff)
+    running = np.cumsum(diff[:, 1:], axis=1)
+    cmnd[:, 1:] = diff[:, 1:] * taus[1:] / np.maximum(running, 1e-12)
+
+    # First local minimum under the threshold, else the global minimum
+    search = cmnd[:, tau_min:tau_max]
+    dips = search < yin_threshold
+    dips[:, :-1] &= search[:, :-1] <= search[:, 1:]
+    has_dip = dips.any(axis=1)
+    tau = np.where(has_dip, dips.argmax(axis=1), search.argmin(axis=1)) + tau_min
+
+    # Parabolic interpolation around the chosen lag
+    rows = np.arange(n_frames)
+    left, centre, right = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, tau + 1]
+    curvature = left - 2 * centre + right
+    shift = 0.5 * (left - right) / np.where(np.abs(curvature) > 1e-12, curvature, np.inf)
+    f0 = sample_rate / (tau + np.clip(shift, -1, 1))
+
+    rms = np.sqrt(energy[:, width] / width)
+    voiced = has_dip & (rms > silence_rms)
+    return f0, 1.0 - centre, voiced
+
+def nearest_swara(f0, voiced):
+    cents = 1200 * (np.log2(np.maximum(f0, 1e-6))[:, None] - _swara_log2[None, :])
+    index = np.abs(cents).argmin(axis=1)
+    offset = cents[np.arange(len(f0)), index]
+    index = np.where(voiced & (np.abs(offset) <= tolerance_cents), index, -1)
+    return index, offset
+
+def track_pitch(source):
+    # Yields per-block frame estimates; only one block of audio is in memory at a time
+    block_size = frame_size + hop_size * (frames_per_block - 1)
+    with sf.SoundFile(source) as recording:
+        sample_rate = recording.samplerate
+        frame_index = 0
+        for block in recording.blocks(blocksize=block_size, overlap=frame_size - hop_size,
+                                      dtype='float32', always_2d=True):
+            mono = block.mean(axis=1)
+            if len(mono) < frame_size:
+                if frame_index:
+                    break
+                mono = np.pad(mono, (0, frame_size - len(mono)))
+            frames = sliding_window_view(mono, frame_size)[::hop_size][:frames_per_block]
+            f0, confidence, voiced = yin_pitch(frames, sample_rate)
+            swara, cents = nearest_swara(f0, voiced)
+            times = ((frame_index + np.arange(len(frames))) * hop_size + frame_size / 2) / sample_rate
+            frame_index += len(frames)
+            yield {'time': times, 'f0': f0, 'confidence': confidence, 'voiced': voiced,
+                   'swara': swara, 'cents': cents, 'sample_rate': sample_rate}
+
+def analyse_recording(source):
+    start = time.perf_counter()
+    blocks = list(track_pitch(source))
+    elapsed = time.perf_counter() - start
+    if not blocks:
+        return None
+    analysis = {key: np.concatenate([block[key] for block in blocks])
+                for key in ('time', 'f0', 'confidence', 'voiced', 'swara', 'cents')}
+    duration = analysis['time'][-1] + frame_size / (2 * blocks[0]['sample_rate'])
+    analysis['duration'] = duration
+    analysis['processing_seconds'] = elapsed
+    analysis['realtime_factor'] = duration / max(elapsed, 1e-9)
+    return analysis
+
+def align_to_sequence(analysis, parsed_sequence, bpm, offset=None, edge_fraction=0.2):
+    times, swara, cents = analysis['time'], analysis['swara'], analysis['cents']
+
+    timeline = []
+    start = 0.0
+    for note, multiplier, octave in parsed_sequence:
+        duration = bpm_to_duration(bpm, multiplier)
+        timeline.append((note, octave, start, duration))
+        start += duration
+
+    # Line the first played note up with the first expected pitched note
+    if offset is None:
+        first_pitched = next((s for note, _, s, _ in timeline if note in note_freq_base), 0.0)
+        voiced_times = times[swara >= 0]
+        offset = (voiced_times[0] - first_pitched) if len(voiced_times) else 0.0
+
+    results = []
+    for note, octave, note_start, duration in timeline:
+        lo = np.searchsorted(times, offset + note_start + edge_fraction * duration)
+        hi = np.searchsorted(times, offset + note_start + (1 - edge_fraction) * duration)
+        window = swara[lo:hi]
+        expected = f"{note} ({octave})" if note in note_freq_base else "Rest"
+        pitched = window[window >= 0]
+
+        if len(window) == 0:
+            played, match, deviation = "—", False, None
+        elif note not in note_freq_base:
+            match = len(pitched) < len(window) / 2
+            played, deviation = ("Rest" if match else "Sound"), None
+        elif len(pitched) < len(window) / 2:
+            played, match, deviation = "Rest", False, None
+        else:
+            detected = np.bincount(pitched, minlength=len(swara_labels)).argmax()
+            played_note, played_octave = swara_labels[detected]
+            played = f"{played_note} ({played_octave})"
+            match = (played_note, played_octave) == (note, octave)
+            deviation = float(np.median(cents[lo:hi][window == detected]))
+        results.append({'start': round(note_start, 2), 'expected': expected, 'played': played,
+                        'match': match, 'cents': None if deviation is None else round(deviation, 1)})
+    return results, offset
@@ -0,0 +1,288 @@
+# Render cost model and admission control for the flute synthesiser.
+# The estimate is computed from the parsed sequence alone, so oversized requests
+# are turned away before any audio buffer is allocated.
+
+import itertools
+import logging
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from flute_synth import (bpm_to_duration, default_sample_rate, default_renderer, parts_block_samples, renderers,
+                         vectorised_chunk_samples)
+
+logger = logging.getLogger("render_cost")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# Cost coefficients per renderer; refit them with `python benchmark_render.py`
+cost_coefficients = {
+    'per_note': {
+        'seconds_per_sample': 1.4e-7,          # oscillator, overtones, noise and envelopes
+        'seconds_per_note': 2e-5,              # fixed per-call overhead of the note generator
+        'seconds_per_copied_sample': 6e-10,    # np.concatenate re-copying the growing output
+        'seconds_per_unique_sample': 0.0,
+        'bytes_per_working_sample': 32,        # float64 temporaries live while one note renders
+        'bytes_per_output_sample': 10,         # int16 output, concatenate copy and WAV buffers
+    },
+    'vectorised': {
+        'seconds_per_sample': 1.45e-7,
+        'seconds_per_note': 5e-6,              # building the per-note count and frequency arrays
+        'seconds_per_copied_sample': 0.0,
+        'seconds_per_unique_sample': 0.0,
+        'bytes_per_working_sample': 64,        # phase, recurrence and envelope arrays of one chunk
+        'bytes_per_output_sample': 8,
+    },
+    'grouped': {
+        'seconds_per_sample': 4.5e-8,          # breath noise and scatter of every instance
+        'seconds_per_note': 1e-5,
+        'seconds_per_copied_sample': 0.0,
+        'seconds_per_unique_sample': 1.1e-7,   # 2-D synthesis of each distinct event, paid once
+        'bytes_per_working_sample': 56,        # float64 batch and temporaries of one length group
+        'bytes_per_output_sample': 8,
+    },
+    # flute_synth.render_parts: samples are note-event samples, output is the shared timeline
+    'parts': {
+        'seconds_per_sample': 1.4e-7,
+        'seconds_per_note': 1e-5,
+        'seconds_per_copied_sample': 0.0,
+        'seconds_per_unique_sample': 0.0,
+        'bytes_per_working_sample': 64,        # float64 temporaries of one block of note pieces
+        'bytes_per_output_sample': 6,          # float32 mix and int16 output (the WAV reuses the latter)
+    },
+}
+
+# Admission limits
+admission_limits = {
+    'max_samples': default_sample_rate * 60 * 10,  # ten minutes of audio at full rate
+    'max_peak_bytes': 512 * 1024 ** 2,
+    'max_cpu_seconds': 20.0,
+    'downgrade_peak_bytes': 128 * 1024 ** 2,
+    'downgrade_cpu_seconds': 3.0,
+}
+downgrade_sample_rate = 16000
+max_concurrent_renders = 2
+max_background_renders = 1   # full-quality upgrades and warm-up, on a budget of their own
+max_pending_background_renders = 8   # running or queued; further upgrades are refused
+queue_timeout_seconds = 30.0
+
+# Imported modules outlive Streamlit reruns, so these are shared by every session
+_render_slots = threading.BoundedSemaphore(max_concurrent_renders)
+_active_renders = 0
+_active_lock = threading.Lock()
+_background_renders = ThreadPoolExecutor(max_workers=max_background_renders, thread_name_prefix="render")
+_pending_background_renders = threading.BoundedSemaphore(max_pending_background_renders)
+
+def estimate_render_cost(parsed_sequence, bpm, sample_rate=default_sample_rate, renderer=default_renderer,
+                         coefficients=None):
+    coefficients = coefficients or cost_coefficients[renderer]
+    note_samples = [int(sample_rate * bpm_to_duration(bpm, multiplier))
+                    for _, multiplier, _ in parsed_sequence]
+    total_samples = sum(note_samples)
+    longest_note = max(note_samples, default=0)
+    if renderer == 'per_note':
+        # Every np.concatenate call copies the whole output rendered so far
+        copied_samples = sum(itertools.accumulate(note_samples))
+        unique_samples = 0
+        working_samples = longest_note
+    elif renderer == 'grouped':
+        # Each distinct (swara, octave, beat length) is synthesised once; the distinct pitches of
+        # one length form a 2-D batch, and only one batch is alive at a time
+        copied_samples = 0
+        unique_events = {(note, octave, n) for (note, _, octave), n in zip(parsed_sequence, note_samples)
+                         if note != '-'}
+        unique_samples = sum(n for _, _, n in unique_events)
+        group_samples = {}
+        for _, _, n in unique_events:
+            group_samples[n] = group_samples.get(n, 0) + n
+        working_samples = max(group_samples.values(), default=0)
+    else:
+        # Whole-melody renders hold one chunk of notes at a time
+        copied_samples = 0
+        unique_samples = 0
+        working_samples = min(total_samples, vectorised_chunk_samples + longest_note)
+
+    peak_bytes = (working_samples * coefficients['bytes_per_working_sample']
+                  + total_samples * coefficients['bytes_per_output_sample'])
+    cpu_seconds = (total_samples * coefficients['seconds_per_sample']
+                   + len(note_samples) * coefficients['seconds_per_note']
+                   + copied_samples * coefficients['seconds_per_copied_sample']
+                   + unique_samples * coefficients['seconds_per_unique_sample'])
+    return {
+        'renderer': renderer,
+        'notes': len(note_samples),
+        'samples': total_samples,
+        'working_samples': working_samples,
+        'copied_samples': copied_samples,
+        'unique_samples': unique_samples,
+        'sample_rate': sample_rate,
+        'duration_seconds': total_samples / sample_rate,
+        'peak_bytes': int(peak_bytes),
+        'cpu_seconds': cpu_seconds,
+    }
+
+def estimate_parts_cost(parts, bpm, sample_rate=default_sample_rate, coefficients=None):
+    # Ensemble mixes pay for every note event of every part, but hold only one block of
+    # temporaries plus the shared timeline
+    coefficients = coefficients or cost_coefficients['parts']
+    timeline_samples = event_samples = events = 0
+    for parsed_sequence, gain in parts:
+        note_samples = [int(sample_rate * bpm_to_duration(bpm, multiplier)) for _, multiplier, _ in parsed_sequence]
+        timeline_samples = max(timeline_samples, sum(note_samples))
+        for (note, _, _), n in zip(parsed_sequence, note_samples):
+            if note != '-' and n > 0 and gain:
+                events += 1
+                event_samples += n
+    working_samples = min(event_samples, parts_block_samples)
+    return {
+        'renderer': 'parts',
+        'notes': events,
+        'samples': timeline_samples,
+        'mixed_samples': event_samples,
+        'working_samples': working_samples,
+        'copied_samples': 0,
+        'unique_samples': 0,
+        'sample_rate': sample_rate,
+        'duration_seconds': timeline_samples / sample_rate,
+        'peak_bytes': int(working_samples * coefficients['bytes_per_working_sample']
+                          + timeline_samples * coefficients['bytes_per_output_sample']),
+        'cpu_seconds': (event_samples * coefficients['seconds_per_sample']
+                        + events * coefficients['seconds_per_note']),
+    }
+
+def _exceeds(estimate, max_samples, max_peak_bytes, max_cpu_seconds):
+    # Sample limits are expressed at full rate so a downgraded render is judged fairly
+    full_rate_samples = estimate['samples'] * default_sample_rate / estimate['sample_rate']
+    return (full_rate_samples > max_samples
+            or estimate['peak_bytes'] > max_peak_bytes
+            or estimate['cpu_seconds'] > max_cpu_seconds)
+
+# ---- Admission policies ----
+# Each policy receives the full-rate and downgraded estimates and returns a decision
+# ('reject', 'downgrade' or 'queue') or None to defer to the next policy.
+
+def reject_oversized(estimate, downgraded):
+    if _exceeds(downgraded, admission_limits['max_samples'], admission_limits['max_peak_bytes'],
+                admission_limits['max_cpu_seconds']):
+        return 'reject'
+    return None
+
+def downgrade_expensive(estimate, downgraded):
+    if _exceeds(estimate, admission_limits['max_samples'], admission_limits['downgrade_peak_bytes'],
+                admission_limits['downgrade_cpu_seconds']):
+        return 'downgrade'
+    return None
+
+def queue_when_busy(estimate, downgraded):
+    if active_renders() >= max_concurrent_renders:
+        return 'queue'
+    return None
+
+admission_policies = [reject_oversized, downgrade_expensive, queue_when_busy]
+
+def admit_render(parsed_sequence, bpm, sample_rate=default_sample_rate, renderer=default_renderer):
+    estimate = estimate_render_cost(parsed_sequence, bpm, sample_rate, renderer)
+    downgraded = estimate_render_cost(parsed_sequence, bpm, min(downgrade_sample_rate, sample_rate), renderer)
+    return _admit(estimate, downgraded, bpm)
+
+def admit_parts_render(parts, bpm, sample_rate=default_sample_rate):
+    estimate = estimate_parts_cost(parts, bpm, sample_rate)
+    downgraded = estimate_parts_cost(parts, bpm, min(downgrade_sample_rate, sample_rate))
+    return _admit(estimate, downgraded, bpm)
+
+def _admit(estimate, downgraded, bpm):
+    decision = 'accept'
+    for policy in admission_policies:
+        verdict = policy(estimate, downgraded)
+        if verdict:
+            decision = verdict
+            break
+
+    chosen = downgraded if decision == 'downgrade' else estimate
+    logger.info("render admission decision=%s renderer=%s bpm=%s notes=%d samples=%d sample_rate=%d "
+                "duration_s=%.1f peak_mb=%.1f cpu_s=%.3f active=%d",
+                decision, chosen['renderer'], bpm, chosen['notes'], chosen['samples'], chosen['sample_rate'],
+                chosen['duration_seconds'], chosen['peak_bytes'] / 1024 ** 2,
+                chosen['cpu_seconds'], active_renders())
+    return decision, chosen
+
+def active_renders():
+    with _active_lock:
+        return _active_renders
+
+@contextmanager
+def render_slot(timeout=queue_timeout_seconds):
+    global _active_renders
+    if not _render_slots.acquire(timeout=timeout):
+        logger.warning("render queue timeout after %.1fs", timeout)
+        raise TimeoutError("No render slot became free in time")
+    with _active_lock:
+        _active_renders += 1
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active_renders -= 1
+        _render_slots.release()
+
+def submit_background_render(render_fn, *args):
+    # Background renders never take a render slot: they queue on their own worker(s), so however
+    # many upgrades are pending, interactive and preview renders only wait for each other.
+    # The executor's queue is unbounded, so a full backlog refuses the job (None) instead
+    if not _pending_background_renders.acquire(blocking=False):
+        logger.warning("background render refused, %d already pending", max_pending_background_renders)
+        return None
+    future = _background_renders.submit(render_fn, *args)
+    # Also called when a queued job is cancelled, so cancelled upgrades free their place
+    future.add_done_callback(lambda _: _pending_background_renders.release())
+    return future
+
+def record_render(estimate, elapsed_seconds):
+    # Logged next to the admission line so predicted and measured cost can be compared; the sample
+    # count is also attached as a record attribute for handlers such as load_test's render counter
+    logger.info("render finished renderer=%s samples=%d sample_rate=%d predicted_cpu_s=%.3f actual_cpu_s=%.3f",
+                estimate['renderer'], estimate['samples'], estimate['sample_rate'], estimate['cpu_seconds'],
+                elapsed_seconds, extra={'render_samples': estimate['samples']})
+
+def calibrate(cases, sample_rate=default_sample_rate, renderer=default_renderer):
+    # Fits the renderer's cost_coefficients to measured timings and tracemalloc peaks
+    render_fn = renderers[renderer]
+    cpu_features, cpu_seconds = [], []
+    mem_features, mem_bytes = [], []
+    for parsed_sequence, bpm in cases:
+        estimate = estimate_render_cost(parsed_sequence, bpm, sample_rate, renderer)
+
+        start = time.perf_counter()
+        render_fn(parsed_sequence, bpm, sample_rate=sample_rate)
+        cpu_seconds.append(time.perf_counter() - start)
+        cpu_features.append([estimate['samples'], estimate['notes'], estimate['copied_samples'],
+                             estimate['unique_samples']])
+
+        tracemalloc.start()
+        render_fn(parsed_sequence, bpm, sample_rate=sample_rate)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mem_bytes.append(peak)
+        mem_features.append([estimate['working_samples'], estimate['samples']])
+
+    cpu_fit = np.linalg.lstsq(np.array(cpu_features, dtype=float), np.array(cpu_seconds), rcond=None)[0]
+    mem_fit = np.linalg.lstsq(np.array(mem_features, dtype=float), np.array(mem_bytes, dtype=float),
+                              rcond=None)[0]
+    cpu_fit = np.maximum(cpu_fit, 0.0)
+    mem_fit = np.maximum(mem_fit, 0.0)
+    return {
+        'seconds_per_sample': float(cpu_fit[0]),
+        'seconds_per_note': float(cpu_fit[1]),
+        'seconds_per_copied_sample': float(cpu_fit[2]),
+        'seconds_per_unique_sample': float(cpu_fit[3]),
+        'bytes_per_working_sample': float(mem_fit[0]),
+        # tracemalloc only sees the synthesis, not the WAV buffers written afterwards
+        'bytes_per_output_sample': float(mem_fit[1]) + 6,
+    }
@@ -0,0 +1,194 @@
+# Pipelined synthesis and encoding for server-side audio.
+# Note blocks are synthesised by the grouped renderer on one thread and encoded by soundfile
+# on another (plus an optional base64 stage), with bounded queues in between. NumPy and libsndfile release the
+# GIL, so the stages overlap and the wall-clock time approaches that of the slowest stage;
+# encoded chunks are handed on as soon as they are ready.
+
+import base64
+import io
+import queue
+import struct
+import threading
+
+from flute_synth import (audio_cache, default_sample_rate, partial_amplitudes, iter_sequence_grouped,
+                         sequence_samples)
+from lazy_imports import lazy_import
+
+sf = lazy_import("soundfile")
+
+audio_mime_types = {'wav': 'audio/wav', 'flac': 'audio/flac'}
+pipeline_block_samples = 1 << 16   # about 1.5 s at 44.1 kHz, so the first chunk is out quickly
+pipeline_queue_depth = 4
+
+_end_of_stage = object()
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+class _StreamSink(io.RawIOBase):
+    # File object for soundfile that passes bytes on as soon as they are written. Encoders seek
+    # back on close to finalise their header; patches to bytes already sent are dropped.
+    def __init__(self):
+        self._pending = bytearray()
+        self._sent = 0
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._sent + len(self._pending)
+        self._position = offset
+        return offset
+
+    def write(self, data):
+        data = bytes(data)
+        offset = self._position - self._sent
+        kept = data[-offset:] if offset < 0 else data
+        offset = max(offset, 0)
+        if offset > len(self._pending):
+            self._pending.extend(bytes(offset - len(self._pending)))
+        self._pending[offset:offset + len(kept)] = kept
+        self._position += len(data)
+        return len(data)
+
+    def take(self):
+        chunk = bytes(self._pending)
+        self._sent += len(chunk)
+        self._pending.clear()
+        return chunk
+
+def _wav_header(n_samples, sample_rate):
+    data_bytes = 2 * n_samples
+    return (b'RIFF' + struct.pack('<I', 36 + data_bytes) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, 2 * sample_rate, 2, 16)
+            + b'data' + struct.pack('<I', data_bytes))
+
+def _flac_with_total_samples(header_chunk, n_samples):
+    # libsndfile fills in STREAMINFO's sample count on close, after the header has been sent;
+    # the count is known up front, so it is set here (the MD5 stays zero, meaning "not computed")
+    streaminfo = 18   # "fLaC", block header, block sizes and frame sizes come first
+    fields = int.from_bytes(header_chunk[streaminfo:streaminfo + 8], 'big')
+    fields = (fields & ~((1 << 36) - 1)) | n_samples
+    return header_chunk[:streaminfo] + fields.to_bytes(8, 'big') + header_chunk[streaminfo + 8:]
+
+def _encode_blocks(blocks, sample_rate, n_samples, audio_format):
+    sink = _StreamSink()
+    if audio_format == 'wav':
+        # The length is known from the parsed sequence, so the header goes out before any audio
+        yield _wav_header(n_samples, sample_rate)
+        encoder = sf.SoundFile(sink, 'w', sample_rate, 1, format='RAW', subtype='PCM_16', endian='LITTLE')
+    else:
+        encoder = sf.SoundFile(sink, 'w', sample_rate, 1, format=audio_format.upper(), subtype='PCM_16')
+    header_pending = audio_format == 'flac'
+    with encoder:
+        for block in blocks:
+            encoder.write(block)
+            chunk = sink.take()
+            if chunk and header_pending:
+                chunk = _flac_with_total_samples(chunk, n_samples)
+                header_pending = False
+            if chunk:
+                yield chunk
+    chunk = sink.take()
+    if chunk and header_pending:
+        chunk = _flac_with_total_samples(chunk, n_samples)
+    if chunk:
+        yield chunk
+
+def _base64_chunks(chunks):
+    # Whole 3-byte groups only, so the pieces concatenate to the base64 of the whole file
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk
+        cut = len(data) - len(data) % 3
+        carry = data[cut:]
+        if cut:
+            yield base64.b64encode(data[:cut])
+    if carry:
+        yield base64.b64encode(carry)
+
+def _threaded_stage(items, name, stop, queue_depth=pipeline_queue_depth):
+    # Runs the generator on its own thread; the consumer reads its output from a bounded queue,
+    # so a fast stage blocks instead of buffering the whole file
+    output = queue.Queue(maxsize=queue_depth)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except Exception as error:
+            put(_StageError(error))
+            return
+        put(_end_of_stage)
+
+    threading.Thread(target=run, name=f"pipeline-{name}", daemon=True).start()
+
+    def read():
+        while True:
+            try:
+                item = output.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            if item is _end_of_stage:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    return read()
+
+def stream_encoded(blocks, sample_rate, n_samples, audio_format='wav', base64_output=False,
+                   queue_depth=pipeline_queue_depth):
+    # Encodes an iterable of int16 blocks on pipeline threads and yields the encoded chunks;
+    # closing the generator early stops every stage
+    stop = threading.Event()
+    try:
+        blocks = _threaded_stage(blocks, 'synthesis', stop, queue_depth)
+        chunks = _threaded_stage(_encode_blocks(blocks, sample_rate, n_samples, audio_format),
+                                 'encode', stop, queue_depth)
+        if base64_output:
+            chunks = _threaded_stage(_base64_chunks(chunks), 'base64', stop, queue_depth)
+        yield from chunks
+    finally:
+        stop.set()
+
+def stream_audio(parsed_sequence, bpm, sample_rate=default_sample_rate, n_partials=len(partial_amplitudes),
+                 audio_format='wav', base64_output=False, block_samples=pipeline_block_samples):
+    blocks = iter_sequence_grouped(parsed_sequence, bpm, sample_rate, n_partials, block_samples=block_samples)
+    return stream_encoded(blocks, sample_rate, sequence_samples(parsed_sequence, bpm, sample_rate),
+                          audio_format, base64_output)
+
+def encode_audio(audio_data, sample_rate, audio_format='wav'):
+    # Single-threaded encoding of a finished buffer, with the same output as the pipeline
+    return b''.join(_encode_blocks([audio_data], sample_rate, len(audio_data), audio_format))
+
+def render_audio(parsed_sequence, bpm, sample_rate=default_sample_rate, n_partials=len(partial_amplitudes),
+                 audio_format='wav'):
+    # Pipelined renders are cached for replays and downloads, like flute_synth.render_parts_wav
+    return _render_audio_cached(tuple(parsed_sequence), bpm, sample_rate, n_partials, audio_format)
+
+@audio_cache()
+def _render_audio_cached(parsed_sequence, bpm, sample_rate, n_partials, audio_format):
+    return b''.join(stream_audio(parsed_sequence, bpm, sample_rate, n_partials, audio_format))
@@ -0,0 +1,197 @@
+# Symbolic playback transport: instead of shipping rendered audio, the server sends the
+# parsed note schedule plus the flute voice parameters and a small Web Audio synth in the
+# browser plays them. Downloads are still rendered on the server (render_pipeline.render_audio).
+
+import json
+import math
+import struct
+
+from flute_synth import note_freq_base, octave_multipliers, partial_amplitudes, bpm_to_duration
+
+# Parameters of generate_note_wave_flute_natural_vibrato, mirrored by the browser synth
+flute_voice = {
+    'partials': partial_amplitudes,
+    'fade_duration': 0.01,
+    'vibrato_depth': 0.001,
+    'vibrato_speed': 2.5,
+    'noise_level': 0.003,
+    'gain': 0.8,
+}
+
+midi_ticks_per_beat = 480
+midi_flute_program = 73  # General MIDI "Flute", zero-based
+midi_max_tempo = 0xFFFFFF   # microseconds per quarter note fit in three bytes
+
+def build_timeline(parsed_sequence, bpm):
+    timeline = []
+    start = 0.0
+    for note, multiplier, octave in parsed_sequence:
+        duration = bpm_to_duration(bpm, multiplier)
+        if note in note_freq_base:
+            timeline.append({
+                'start': round(start, 4),
+                'duration': round(duration, 4),
+                'frequency': round(note_freq_base[note] * octave_multipliers[octave], 3),
+                'label': f"{note} ({octave})",
+            })
+        start += duration
+    return timeline, start
+
+def schedule_payload(parsed_sequence, bpm):
+    timeline, total_duration = build_timeline(parsed_sequence, bpm)
+    return {
+        'bpm': bpm,
+        'total_duration': round(total_duration, 4),
+        'voice': flute_voice,
+        'notes': timeline,
+    }
+
+def _midi_variable_length(value):
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+def export_midi(parsed_sequence, bpm):
+    # Single-track (format 0) Standard MIDI File of the parsed sequence
+    # The tempo field holds at most 0xFFFFFF microseconds per quarter note (about 3.6 BPM); slower
+    # melodies span several quarter notes per beat, so the durations stay exact
+    quarters_per_beat = max(1, math.ceil(60_000_000 / bpm / midi_max_tempo))
+    events = bytearray()
+    events += b'\x00\xFF\x51\x03' + int(60_000_000 / (bpm * quarters_per_beat)).to_bytes(3, 'big')
+    events += b'\x00' + bytes([0xC0, midi_flute_program])
+
+    pending_ticks = 0
+    for note, multiplier, octave in parsed_sequence:
+        ticks = int(round(multiplier * quarters_per_beat * midi_ticks_per_beat))
+        if note not in note_freq_base:
+            pending_ticks += ticks
+            continue
+        frequency = note_freq_base[note] * octave_multipliers[octave]
+        pitch = max(0, min(127, int(round(69 + 12 * math.log2(frequency / 440.0)))))
+        events += _midi_variable_length(pending_ticks) + bytes([0x90, pitch, 96])
+        events += _midi_variable_length(ticks) + bytes([0x80, pitch, 0])
+        pending_ticks = 0
+    events += _midi_variable_length(pending_ticks) + b'\xFF\x2F\x00'
+
+    header = b'MThd' + struct.pack('>IHHH', 6, 0, 1, midi_ticks_per_beat)
+    return header + b'MTrk' + struct.pack('>I', len(events)) + bytes(events)
+
+_player_template = """
+<div style="font-family: sans-serif;">
+  <button id="play" style="padding: 0.4rem 1rem; font-size: 16px;">▶️ Play in browser</button>
+  <button id="stop" style="padding: 0.4rem 1rem; font-size: 16px;">⏹️ Stop</button>
+  <span id="status" style="margin-left: 1rem; color: #34495e;"></span>
+</div>
+<script>
+const schedule = __SCHEDULE__;
+const status = document.getElementById("status");
+let ctx = null;
+let voices = [];
+
+function noiseBuffer(ctx) {
+  const buffer = ctx.createBuffer(1, ctx.sampleRate, ctx.sampleRate);
+  const data = buffer.getChannelData(0);
+  for (let i = 0; i < data.length; i++) {
+    // Box-Muller: unit-variance noise like np.random.normal
+    data[i] = Math.sqrt(-2 * Math.log(1 - Math.random())) * Math.cos(2 * Math.PI * Math.random());
+  }
+  return buffer;
+}
+
+function envelope(duration, fade, points) {
+  // Half-sine swell with linear fades, as in generate_note_wave_flute_natural_vibrato
+  const curve = new Float32Array(points);
+  for (let i = 0; i < points; i++) {
+    const t = duration * i / (points - 1);
+    const fadeGain = Math.min(1, t / fade, (duration - t) / fade);
+    curve[i] = Math.sin(Math.PI * t / duration) * Math.max(0, fadeGain);
+  }
+  return curve;
+}
+
+function stop() {
+  voices.forEach(node => { try { node.stop(); } catch (e) {} });
+  voices = [];
+  if (ctx) { ctx.close(); ctx = null; }
+  status.textContent = "";
+}
+
+function play() {
+  stop();
+  ctx = new (window.AudioContext || window.webkitAudioContext)();
+  const voice = schedule.voice;
+  const noise = noiseBuffer(ctx);
+  const norm = voice.gain / voice.partials.reduce((a, b) => a + b, 0);
+  const t0 = ctx.currentTime + 0.1;
+
+  schedule.notes.forEach(note => {
+    const start = t0 + note.start;
+    const amp = ctx.createGain();
+    amp.gain.setValueAtTime(0, start);
+    amp.gain.setValueCurveAtTime(envelope(note.duration, voice.fade_duration, 64), start, note.duration);
+    amp.connect(ctx.destination);
+
+    const lfo = ctx.createOscillator();
+    lfo.frequency.value = voice.vibrato_speed;
+    voices.push(lfo);
+
+    voice.partials.forEach((level, index) => {
+      const harmonic = index + 1;
+      const osc = ctx.createOscillator();
+      osc.frequency.value = note.frequency * harmonic;
+      // Phase vibrato of depth d at rate r is a frequency swing of d * r Hz per harmonic
+      const depth = ctx.createGain();
+      depth.gain.value = voice.vibrato_depth * voice.vibrato_speed * harmonic;
+      lfo.connect(depth).connect(osc.frequency);
+      const partialGain = ctx.createGain();
+      partialGain.gain.value = level * norm;
+      osc.connect(partialGain).connect(amp);
+      osc.start(start);
+      osc.stop(start + note.duration);
+      voices.push(osc);
+    });
+
+    const breath = ctx.createBufferSource();
+    breath.buffer = noise;
+    breath.loop = true;
+    const breathGain = ctx.createGain();
+    breathGain.gain.value = voice.noise_level * norm;
+    breath.connect(breathGain).connect(amp);
+    breath.start(start, Math.random());
+    breath.stop(start + note.duration);
+    voices.push(breath);
+
+    lfo.start(start);
+    lfo.stop(start + note.duration);
+  });
+
+  const tick = () => {
+    if (!ctx) return;
+    const now = ctx.currentTime - t0;
+    const current = schedule.notes.find(n => now >= n.start && now < n.start + n.duration);
+    status.textContent = now >= schedule.total_duration ? "" : (current ? "🎵 " + current.label : "Rest");
+    if (now < schedule.total_duration) requestAnimationFrame(tick);
+  };
+  requestAnimationFrame(tick);
+}
+
+document.getElementById("play").onclick = play;
+document.getElementById("stop").onclick = stop;
+if (__AUTOPLAY__) {
+  play();
+  if (ctx && ctx.state === "suspended") {
+    stop();
+    status.textContent = "Press ▶️ to start playback.";
+  }
+}
+</script>
+"""
+
+def web_audio_player_html(parsed_sequence, bpm, autoplay=True):
+    payload = json.dumps(schedule_payload(parsed_sequence, bpm), separators=(',', ':'))
+    return (_player_template
+            .replace('__SCHEDULE__', payload.replace('</', '<\\/'))
+            .replace('__AUTOPLAY__', 'true' if autoplay else 'false'))
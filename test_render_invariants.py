@@ -0,0 +1,67 @@
+# Invariants the renderers rely on, checked with pytest:
+#
+#   python -m pytest -q test_render_invariants.py
+
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from breath_noise import noise_key, philox_noise
+from flute_synth import (audio_cache, iter_sequence_grouped, iter_sequence_vectorised, parse_notes_input,
+                         render_sequence_grouped, render_sequence_vectorised)
+from render_pipeline import stream_audio
+
+sample_rate = 8000
+melodies = [("DS>DP,GRSR,G-GR,GPD_", 60), ("S___R<_G>--S", 45), ("-,-", 120)]
+block_sizes = [1, 997, 8000, 1 << 16]
+
+@pytest.mark.parametrize("start_sample, n", [(0, 1), (1, 7), (3, 4096), (12345, 1000), (65536, 3)])
+def test_philox_noise_depends_only_on_absolute_sample(start_sample, n):
+    # Any window of the stream equals the same samples taken from the start of the stream
+    key = noise_key("ab" * 32)
+    window = philox_noise(key, start_sample, n)
+    assert np.array_equal(window, philox_noise(key, 0, start_sample + n)[start_sample:])
+
+@pytest.mark.parametrize("melody, bpm", melodies)
+@pytest.mark.parametrize("block_samples", block_sizes)
+def test_vectorised_blocks_do_not_change_the_output(melody, bpm, block_samples):
+    parsed_sequence = parse_notes_input(melody)
+    blocks = list(iter_sequence_vectorised(parsed_sequence, bpm, sample_rate, block_samples=block_samples))
+    assert all(block.dtype == np.int16 for block in blocks)
+    assert np.concatenate(blocks).tobytes() == render_sequence_vectorised(parsed_sequence, bpm, sample_rate).tobytes()
+
+@pytest.mark.parametrize("melody, bpm", melodies)
+@pytest.mark.parametrize("block_samples", block_sizes)
+def test_grouped_blocks_do_not_change_the_output(melody, bpm, block_samples):
+    parsed_sequence = parse_notes_input(melody)
+    blocks = list(iter_sequence_grouped(parsed_sequence, bpm, sample_rate, block_samples=block_samples))
+    assert all(block.dtype == np.int16 for block in blocks)
+    assert np.concatenate(blocks).tobytes() == render_sequence_grouped(parsed_sequence, bpm, sample_rate).tobytes()
+
+@pytest.mark.parametrize("melody, bpm", melodies)
+@pytest.mark.parametrize("audio_format", ["wav", "flac"])
+def test_streamed_audio_decodes_to_the_grouped_render(melody, bpm, audio_format):
+    # Small blocks, so headers are sent (and for FLAC, patched) before most of the audio exists
+    parsed_sequence = parse_notes_input(melody)
+    encoded = b''.join(stream_audio(parsed_sequence, bpm, sample_rate, audio_format=audio_format, block_samples=997))
+    decoded, decoded_rate = sf.read(io.BytesIO(encoded), dtype='int16')
+    assert decoded_rate == sample_rate
+    assert np.array_equal(decoded, render_sequence_grouped(parsed_sequence, bpm, sample_rate))
+
+def test_audio_cache_is_bounded_by_bytes():
+    renders = []
+
+    @audio_cache(max_bytes=10)
+    def render(size):
+        renders.append(size)
+        return b'x' * size
+
+    render(3), render(4), render(3)
+    assert renders == [3, 4]
+    render(5)  # evicts the least recently used entry (4) to stay within 10 bytes
+    render(3), render(4)
+    assert renders == [3, 4, 5, 4]
+    render(11), render(11)  # larger than the whole cache, so never kept
+    assert renders == [3, 4, 5, 4, 11, 11]
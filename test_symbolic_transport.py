@@ -0,0 +1,48 @@
+# MIDI export checks, run with pytest:
+#
+#   python -m pytest -q test_symbolic_transport.py
+
+import struct
+
+import pytest
+
+from flute_synth import bpm_to_duration, parse_notes_input
+from symbolic_transport import export_midi
+
+def _read_variable_length(data, position):
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, position
+
+def _midi_tempo_and_seconds(midi):
+    # Tempo and total length of a format 0 file as export_midi writes it
+    _, _, _, ticks_per_quarter = struct.unpack('>IHHH', midi[4:14])
+    track_length, = struct.unpack('>I', midi[18:22])
+    data = midi[22:22 + track_length]
+    position, ticks, tempo = 0, 0, None
+    while position < len(data):
+        delta, position = _read_variable_length(data, position)
+        ticks += delta
+        status = data[position]
+        if status == 0xFF:
+            kind, length = data[position + 1], data[position + 2]
+            if kind == 0x51:
+                tempo = int.from_bytes(data[position + 3:position + 3 + length], 'big')
+            position += 3 + length
+        elif status & 0xF0 == 0xC0:
+            position += 2
+        else:
+            position += 3
+    return tempo, ticks * tempo / ticks_per_quarter / 1e6
+
+@pytest.mark.parametrize("bpm", [1, 2, 3, 4, 60, 200])
+def test_midi_length_matches_the_melody_at_any_tempo(bpm):
+    parsed_sequence = parse_notes_input("DS>DP,GRSR,G-GR,GPD_")
+    tempo, seconds = _midi_tempo_and_seconds(export_midi(parsed_sequence, bpm))
+    assert 0 < tempo <= 0xFFFFFF
+    expected = sum(bpm_to_duration(bpm, multiplier) for _, multiplier, _ in parsed_sequence)
+    assert seconds == pytest.approx(expected, rel=1e-6)
@@ -0,0 +1,78 @@
+# Warm-up for a freshly started server.
+# Fills the caches the first user would otherwise pay for (lazily imported modules, the
+# breath-noise bank and the default melody's rendered audio). Streamlit has no hook that runs
+# before the server takes traffic, so the warm-up is started by the first script run
+# (metronomev4) and overlaps that user's first requests. It runs on the background render
+# budget, not on a render slot, so it never makes an interactive render wait; the first
+# page load is not held up by it either.
+#
+#   python warmup.py    # runs the warm-up in the foreground and prints the time per step
+
+import threading
+import time
+
+import breath_noise
+import flute_synth
+from flute_synth import render_qualities, parse_notes_input
+from lazy_imports import preload
+from render_cost import logger, submit_background_render
+import render_pipeline
+from render_pipeline import render_audio
+
+# The apps' default input sequence and BPM
+warmup_melodies = (("DS>DP,GRSR,G-GR,GPD_", 60),)
+warmup_audio_formats = ('wav',)
+
+warmup_status = {'state': 'not started', 'steps': {}}
+_warmup_lock = threading.Lock()
+
+def _timed(name, fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    warmup_status['steps'][name] = time.perf_counter() - start
+
+def _load_practice_tools():
+    import pitch_tracker
+    preload(pitch_tracker.sf)
+
+def warm_up(melodies=warmup_melodies, audio_formats=warmup_audio_formats):
+    warmup_status['state'] = 'running'
+    start = time.perf_counter()
+    try:
+        _timed('imports', preload, flute_synth.wavfile, render_pipeline.sf)
+        _timed('practice tools', _load_practice_tools)
+        if breath_noise.noise_method == 'bank':
+            _timed('noise bank', breath_noise.bank_noise, breath_noise.default_noise_key, 0, 1)
+        for melody, bpm in melodies:
+            parsed_sequence = parse_notes_input(melody)
+            for quality, settings in render_qualities.items():
+                for audio_format in audio_formats:
+                    # Same cache keys as metronomev4's server audio and downloads
+                    _timed(f"{melody} {quality} {audio_format}", render_audio, parsed_sequence, bpm,
+                           settings['sample_rate'], settings['n_partials'], audio_format)
+    except Exception:
+        # Nobody waits on the background future, so the failure is logged here; the caches
+        # simply fill on first use instead
+        warmup_status['state'] = 'failed'
+        logger.exception("warm-up failed after %.2fs", time.perf_counter() - start)
+        raise
+    warmup_status['state'] = 'done'
+    warmup_status['seconds'] = time.perf_counter() - start
+    logger.info("warm-up finished in %.2fs", warmup_status['seconds'])
+
+def start_warm_up():
+    # Modules outlive script reruns, so only the first run after a deploy starts the warm-up
+    with _warmup_lock:
+        if warmup_status['state'] != 'not started':
+            return None
+        warmup_status['state'] = 'queued'
+    future = submit_background_render(warm_up)
+    if future is None:
+        warmup_status['state'] = 'not started'  # background backlog is full; a later run retries
+    return future
+
+if __name__ == "__main__":
+    warm_up()
+    for step, seconds in warmup_status['steps'].items():
+        print(f"{seconds:8.3f}s  {step}")
+    print(f"{warmup_status['seconds']:8.3f}s  total")